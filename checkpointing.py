@@ -0,0 +1,201 @@
+"""
+Resumable training checkpoints.
+
+A checkpoint lives in ``<model_dir>/checkpoint``: the model itself (``save_pretrained``) plus
+``training_state.pt``, which holds everything else needed to continue training exactly where
+it stopped: the optimizer and scheduler states, the step counter, the loss histories, the
+random number generator states and the position of the data pipeline in every bitext.
+"""
+
+import os
+import random
+import shutil
+import threading
+import numpy as np
+import torch
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+CHECKPOINT_DIR = "checkpoint"
+TRAINING_STATE = "training_state.pt"
+
+
+def random_states() -> dict:
+    states = {"python": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        states["cuda"] = torch.cuda.get_rng_state_all()
+    return states
+
+
+def restore_random_states(states: dict):
+    random.setstate(states["python"])
+    np.random.set_state(states["numpy"])
+    torch.set_rng_state(states["torch"])
+    if "cuda" in states and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(states["cuda"])
+
+
+def checkpoint_path(model_dir: str) -> Path:
+    return Path(model_dir) / CHECKPOINT_DIR
+
+
+def has_checkpoint(model_dir: str) -> bool:
+    return (checkpoint_path(model_dir) / TRAINING_STATE).exists()
+
+
+class CheckpointWriter:
+    """
+    Writes checkpoints on a background thread, so that serialization does not stall training.
+
+    Each save is submitted under a key (its destination). If a save is submitted while an
+    older one for the same key is still waiting, the older one is superseded and never
+    written, so at most one save per destination is in flight and one is waiting. An exception
+    raised while writing is re-raised by the next call to `save`, `wait` or `close`.
+    """
+
+    def __init__(self):
+        self.pending = dict()  # key => write function, oldest first
+        self.writing = False
+        self.error = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def save(self, key: str, write: Callable[[], None]):
+        with self.condition:
+            self._raise_error()
+            if key in self.pending:
+                print(f"Skipping superseded save of {key}.")
+                del self.pending[key]
+            self.pending[key] = write
+            self.condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while len(self.pending) == 0 and not self.closed:
+                    self.condition.wait()
+                if len(self.pending) == 0:
+                    return
+                key = next(iter(self.pending))
+                write = self.pending.pop(key)
+                self.writing = True
+            try:
+                write()
+            except BaseException as e:
+                with self.condition:
+                    self.error = e
+            finally:
+                with self.condition:
+                    self.writing = False
+                    self.condition.notify_all()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def wait(self):
+        """Blocks until every submitted save has been written."""
+        with self.condition:
+            while len(self.pending) > 0 or self.writing:
+                self.condition.wait()
+            self._raise_error()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        self._raise_error()
+
+
+def cpu_snapshot(state):
+    """
+    Copies the tensors of a (nested) state to CPU memory, so that training can keep updating
+    the originals while the copy is written. Tensors that share storage (e.g. tied
+    embeddings) stay shared in the copy.
+    """
+    copies = dict()
+
+    def snapshot(obj):
+        if isinstance(obj, torch.Tensor):
+            key = (obj.data_ptr(), obj.device, obj.dtype, tuple(obj.shape), tuple(obj.stride()))
+            if key not in copies:
+                copies[key] = obj.detach().to("cpu", copy=True)
+            return copies[key]
+        if isinstance(obj, dict):
+            return type(obj)((k, snapshot(v)) for k, v in obj.items())
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(snapshot(v) for v in obj)
+        return obj
+
+    return snapshot(state)
+
+
+def save_model(model, model_dir: str, writer: Optional[CheckpointWriter] = None):
+    """
+    Like `model.save_pretrained(model_dir)`, but the files are written to a temporary directory
+    first and then renamed into `model_dir`, weights last. With a writer, the weights are
+    snapshotted to CPU and written in the background.
+    """
+    state_dict = cpu_snapshot(model.state_dict()) if writer is not None else None
+    tmp_dir = Path(model_dir) / ".save.tmp"
+
+    def write():
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        model.save_pretrained(tmp_dir, state_dict=state_dict)
+        for file_name in sorted(os.listdir(tmp_dir), key=lambda name: name.endswith(".safetensors")):
+            os.replace(tmp_dir / file_name, Path(model_dir) / file_name)
+        tmp_dir.rmdir()
+
+    if writer is None:
+        write()
+    else:
+        writer.save(str(model_dir), write)
+
+
+def save_checkpoint(model_dir: str, model, training_state: dict, writer: Optional[CheckpointWriter] = None):
+    """
+    Writes the checkpoint to a temporary directory and then swaps it in, so that a job killed
+    mid-write leaves the previous checkpoint intact. With a writer, the model and training
+    state are snapshotted to CPU and written in the background.
+    """
+    final_dir = checkpoint_path(model_dir)
+    tmp_dir = final_dir.with_name(f"{CHECKPOINT_DIR}.tmp")
+    old_dir = final_dir.with_name(f"{CHECKPOINT_DIR}.old")
+    state_dict = None
+    if writer is not None:
+        state_dict, training_state = cpu_snapshot((model.state_dict(), training_state))
+
+    def write():
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        model.save_pretrained(tmp_dir, state_dict=state_dict)
+        torch.save(training_state, tmp_dir / TRAINING_STATE)
+        if final_dir.exists():
+            os.replace(final_dir, old_dir)
+        os.replace(tmp_dir, final_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    if writer is None:
+        write()
+    else:
+        writer.save(str(final_dir), write)
+
+
+def remove_checkpoint(model_dir: str):
+    """Deletes the checkpoint of a finished run, with anything left over from an interrupted save."""
+    final_dir = checkpoint_path(model_dir)
+    for path in [final_dir, final_dir.with_name(f"{CHECKPOINT_DIR}.tmp"), final_dir.with_name(f"{CHECKPOINT_DIR}.old")]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def load_checkpoint(model_dir: str) -> Tuple[Path, dict]:
+    """Returns the directory of the checkpointed model, and the training state saved with it."""
+    final_dir = checkpoint_path(model_dir)
+    old_dir = final_dir.with_name(f"{CHECKPOINT_DIR}.old")
+    if not final_dir.exists() and old_dir.exists():  # interrupted between the two renames
+        os.replace(old_dir, final_dir)
+    training_state = torch.load(final_dir / TRAINING_STATE, weights_only=False)
+    return final_dir, training_state
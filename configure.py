@@ -1 +1,3 @@
-USE_CUDA=True
+import torch
+
+USE_CUDA = torch.cuda.is_available()
@@ -1,12 +1,107 @@
+import io
+import itertools
+import os
+import queue
 import random
+import threading
+import time
+import numpy as np
 from typing import Dict, Tuple, List, Optional, Iterator, Callable
-from torch.utils.data import DataLoader, IterableDataset
 
 from tokenization import Tokenizer
 
 CorpusId = Tuple[str, str] # typedef
 
-class MultifileBitext(IterableDataset):
+
+class LineIndex:
+    """
+    Byte offsets of the start of every line in a text file.
+
+    The offsets are persisted in a sidecar file (``<file>.lineidx.npy``) so that they
+    are computed once per file. The sidecar records the size and modification time of
+    the text file, and is rebuilt whenever either of them changes. If the sidecar cannot
+    be written (e.g. the directory is read-only), the index is simply kept in memory.
+    Lines end at line feeds only (see `stream_lines`).
+    """
+
+    SUFFIX = ".lineidx.npy"
+    _cache = dict()  # file path => LineIndex (so each process stats the file but reads it once)
+
+    def __init__(self, offsets: np.ndarray):
+        self.offsets = offsets  # offsets[k] is the start of line k; offsets[-1] is the file size
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def offset(self, line_num: int) -> int:
+        return int(self.offsets[min(line_num, len(self))])
+
+    @staticmethod
+    def for_file(file_path: str) -> "LineIndex":
+        file_path = str(file_path)
+        stat = os.stat(file_path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        cached = LineIndex._cache.get(file_path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        sidecar = file_path + LineIndex.SUFFIX
+        index = None
+        try:
+            saved = np.load(sidecar, mmap_mode="r")
+            if tuple(int(x) for x in saved[:2]) == signature:
+                index = LineIndex(saved[2:])
+        except (OSError, ValueError):
+            pass
+        if index is None:
+            index = LineIndex(LineIndex._compute_offsets(file_path, stat.st_size))
+            LineIndex._save(sidecar, signature, index.offsets)
+        LineIndex._cache[file_path] = (signature, index)
+        return index
+
+    @staticmethod
+    def _compute_offsets(file_path: str, file_size: int, chunk_size: int = 1 << 24) -> np.ndarray:
+        offsets = [np.zeros(1, dtype=np.int64)]
+        position = 0
+        with open(file_path, "rb") as f:
+            chunk = f.read(chunk_size)
+            while chunk:
+                newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord("\n"))
+                offsets.append(newlines.astype(np.int64) + position + 1)
+                position += len(chunk)
+                chunk = f.read(chunk_size)
+        offsets = np.concatenate(offsets)
+        if offsets[-1] != file_size:  # the last line has no trailing newline
+            offsets = np.append(offsets, file_size)
+        return offsets
+
+    @staticmethod
+    def _save(sidecar: str, signature: Tuple[int, int], offsets: np.ndarray):
+        tmp_path = f"{sidecar}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as writer:
+                np.save(writer, np.concatenate([np.array(signature, dtype=np.int64), offsets]))
+            os.replace(tmp_path, sidecar)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def stream_lines(file_path: str, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+    """
+    Yields lines ``start`` (inclusive) through ``end`` (exclusive) of a text file, without newlines.
+    Lines end at line feeds only, as in LineIndex, so that a stray carriage return inside a line
+    does not shift the line numbers (a carriage return right before the line feed is removed).
+    """
+    offset = LineIndex.for_file(file_path).offset(start) if start > 0 else 0
+    with open(file_path, "rb") as raw:
+        raw.seek(offset)
+        with io.TextIOWrapper(raw, encoding="utf-8", newline="\n") as f:
+            for line_num, line in enumerate(f, start):
+                if end is not None and line_num >= end:
+                    break
+                yield line.rstrip("\r\n")
+
+class MultifileBitext:
     def __init__(self, lang1_files: List[str], lang2_files: List[str], lines: Optional[List[Tuple[int, int]]] = None):
         self.lang1_files = lang1_files
         self.lang2_files = lang2_files
@@ -15,15 +110,11 @@ class MultifileBitext(IterableDataset):
     def line_streamer(self, lang_index) -> Iterator[str]:
         lang_files = self.lang1_files if lang_index == 0 else self.lang2_files
         for file_index in range(len(self.lang1_files)):
-            file_path = lang_files[file_index]
-            current_line = 0
-            with open(file_path, "r", encoding="utf-8") as f:
-                for line in f:  
-                    if self.lines is None or self.lines[file_index][0] <= current_line < self.lines[file_index][1]:       
-                        yield line.rstrip("\n")                
-                    current_line += 1
-                    if self.lines is not None and current_line >= self.lines[file_index][1]:
-                        break
+            if self.lines is None:
+                yield from stream_lines(lang_files[file_index])
+            else:
+                start, end = self.lines[file_index]
+                yield from stream_lines(lang_files[file_index], start, end)
 
     def __iter__(self) -> Iterator[Tuple[str, str]]:
         
@@ -32,21 +123,20 @@ class MultifileBitext(IterableDataset):
         )
 
 
-class Bitext(IterableDataset):
+class Bitext:
     def __init__(self, lang1_file: str, lang2_file: str, lines: Optional[Tuple[int, int]] = None):
         self.lang1_file = lang1_file
         self.lang2_file = lang2_file
         self.lines = lines        
         
     def line_streamer(self, file_path: str) -> Iterator[str]:
-        current_line = 0
-        with open(file_path, "r", encoding="utf-8") as f:
-            for line in f:  
-                if self.lines is None or self.lines[0] <= current_line < self.lines[1]:       
-                    yield line.rstrip("\n")                
-                current_line += 1
-                if self.lines is not None and current_line >= self.lines[1]:
-                    break
+        if self.lines is None:
+            return stream_lines(file_path)
+        return stream_lines(file_path, self.lines[0], self.lines[1])
+
+    def skip(self, num_lines: int) -> "Bitext":
+        start, end = self.lines if self.lines is not None else (0, None)
+        return Bitext(self.lang1_file, self.lang2_file, (start + num_lines, end))
 
     def __iter__(self) -> Iterator[Tuple[str, str]]:
         return zip(
@@ -54,17 +144,211 @@ class Bitext(IterableDataset):
         )
 
 
+def word_counts(sents: List[str]) -> List[int]:
+    return [len(sent.split()) for sent in sents]
+
+
+class _Skipped:
+    def __init__(self, dataset, num_lines: int):
+        self.dataset = dataset
+        self.num_lines = num_lines
+
+    def __iter__(self):
+        return itertools.islice(iter(self.dataset), self.num_lines, None)
+
+
+class Shard:
+    """Every `num_shards`-th example of a dataset, starting from example `index`."""
+
+    def __init__(self, dataset, index: int, num_shards: int):
+        self.dataset = dataset
+        self.index = index
+        self.num_shards = num_shards
+
+    def skip(self, num_lines: int) -> "Shard":
+        return Shard(skip_lines(self.dataset, num_lines * self.num_shards), self.index, self.num_shards)
+
+    def __iter__(self):
+        return itertools.islice(iter(self.dataset), self.index, None, self.num_shards)
+
+
+class EncodedBitext:
+    """
+    The examples of a text bitext as token ids. Lines are read and tokenized `chunk_size` at a
+    time, each side with `encode_fn` and its own corpus id (for its language code). With a token
+    budget, the ids that batches are sized by are then the ids that are trained on, so each line
+    is tokenized once.
+    """
+
+    def __init__(
+        self,
+        bitext,
+        encode_fn: Callable[[List[str], CorpusId], List[List[int]]],
+        corpora: Tuple[CorpusId, CorpusId],
+        chunk_size: int = 1000
+    ):
+        self.bitext = bitext
+        self.encode_fn = encode_fn
+        self.corpora = corpora
+        self.chunk_size = chunk_size
+
+    def skip(self, num_lines: int) -> "EncodedBitext":
+        return EncodedBitext(skip_lines(self.bitext, num_lines), self.encode_fn, self.corpora, self.chunk_size)
+
+    def __iter__(self):
+        examples = iter(self.bitext)
+        chunk = list(itertools.islice(examples, self.chunk_size))
+        while len(chunk) > 0:
+            src, tgt = zip(*chunk)
+            yield from zip(self.encode_fn(list(src), self.corpora[0]), self.encode_fn(list(tgt), self.corpora[1]))
+            chunk = list(itertools.islice(examples, self.chunk_size))
+
+
+def transpose(batch: List[Tuple[str, str]]) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """The default collate function: a batch of (source, target) pairs => (sources, targets)."""
+    return tuple(zip(*batch))
+
+
+def skip_lines(bitext, num_lines: int):
+    """The examples of a bitext from the `num_lines`-th on (seeking, if the bitext supports it)."""
+    if num_lines == 0:
+        return bitext
+    if hasattr(bitext, "skip"):
+        return bitext.skip(num_lines)
+    return _Skipped(bitext, num_lines)
+
+
+class BatchCursor:
+    """
+    Iterates over the batches of one bitext, and remembers its position so that iteration can
+    be resumed later (see `state`) without re-reading the lines that were already consumed.
+
+    Without `max_tokens`, batches hold `batch_size` consecutive examples (and an incomplete
+    final batch is dropped). With `max_tokens`, examples of similar length are grouped into
+    batches that fit a token budget: examples are read `shuffle_window` at a time and sorted
+    by length, batches are cut greedily so that the padded size of each batch (its number of
+    examples times the sum of its longest source and longest target) stays within `max_tokens`
+    (an example that is too long on its own gets a batch to itself), and the batches of the
+    window are shuffled, so consecutive batches do not grow steadily longer.
+    """
+
+    def __init__(
+        self,
+        bitext,
+        batch_size: int,
+        collate_fn: Optional[Callable] = None,
+        max_tokens: Optional[int] = None,
+        shuffle_window: int = 10000,
+        lengths_fn: Callable[[List], List[int]] = None,
+        rng: Optional[random.Random] = None,
+        state: Optional[dict] = None
+    ):
+        self.bitext = bitext
+        self.batch_size = batch_size
+        self.collate_fn = collate_fn
+        self.max_tokens = max_tokens
+        self.shuffle_window = shuffle_window
+        self.lengths_fn = lengths_fn
+        self.rng = rng if rng is not None else random.Random()
+        state = state if state is not None else {"position": 0, "emitted": 0, "window_seed": None}
+        self.position = state["position"] # examples before the current window (or before the next batch)
+        self.emitted = state["emitted"] # batches already produced from the current window
+        self.window_seed = state["window_seed"]
+        if max_tokens is None:
+            self.batches = self._fixed_size_batches()
+        else:
+            self.batches = self._token_budget_batches()
+
+    def state(self) -> dict:
+        return {"position": self.position, "emitted": self.emitted, "window_seed": self.window_seed}
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.batches)
+
+    def _fixed_size_batches(self):
+        collate_fn = self.collate_fn if self.collate_fn is not None else transpose
+        examples = iter(skip_lines(self.bitext, self.position))
+        batch = list(itertools.islice(examples, self.batch_size))
+        while len(batch) == self.batch_size:
+            self.position += self.batch_size
+            yield collate_fn(batch)
+            batch = list(itertools.islice(examples, self.batch_size))
+
+    def _token_budget_batches(self):
+        collate_fn = self.collate_fn if self.collate_fn is not None else transpose
+        examples = iter(skip_lines(self.bitext, self.position))
+        resuming = self.window_seed is not None
+        window = list(itertools.islice(examples, self.shuffle_window))
+        while len(window) > 0:
+            if not resuming:
+                self.window_seed, self.emitted = self.rng.randrange(2 ** 32), 0
+            batches = self._bucket_window(window, random.Random(self.window_seed))
+            for batch in batches[self.emitted :]:
+                self.emitted += 1
+                yield collate_fn(batch)
+            self.position += len(window)
+            self.window_seed, self.emitted, resuming = None, 0, False
+            window = list(itertools.islice(examples, self.shuffle_window))
+
+    def _bucket_window(self, window, rng):
+        src, tgt = zip(*window)
+        src_lengths, tgt_lengths = self.lengths_fn(list(src)), self.lengths_fn(list(tgt))
+        order = sorted(range(len(window)), key=lambda k: (src_lengths[k] + tgt_lengths[k], k))
+        batches, batch, max_src, max_tgt = [], [], 0, 0
+        for k in order:
+            new_max_src, new_max_tgt = max(max_src, src_lengths[k]), max(max_tgt, tgt_lengths[k])
+            if len(batch) > 0 and (len(batch) + 1) * (new_max_src + new_max_tgt) > self.max_tokens:
+                batches.append(batch)
+                batch, new_max_src, new_max_tgt = [], src_lengths[k], tgt_lengths[k]
+            batch.append(window[k])
+            max_src, max_tgt = new_max_src, new_max_tgt
+        batches.append(batch)
+        rng.shuffle(batches)
+        return batches
+
+
 class MixtureOfBitexts:
     def __init__(
         self,
         bitexts: Dict[Tuple[str, str], Bitext],
         batch_size: int,
         sampling_probs: Optional[List[float]] = None,
-        only_once_thru: bool = False
+        only_once_thru: bool = False,
+        collate_fn: Optional[Callable] = None,
+        seed: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+        shuffle_window: int = 10000,
+        lengths_fn: Callable[[List], List[int]] = word_counts,
+        rank: int = 0,
+        world_size: int = 1,
+        encode_fn: Optional[Callable[[List[str], CorpusId], List[List[int]]]] = None
     ):
+        """
+        If `max_tokens` is given, batches group examples of similar length (as measured by
+        `lengths_fn`) under a token budget, instead of holding `batch_size` examples in file
+        order (see BatchCursor).
+
+        With `encode_fn`, examples are the token ids of the lines rather than their text (see
+        EncodedBitext); `collate_fn` and `lengths_fn` should then expect ids.
+
+        For data-parallel training, each of the `world_size` processes creates its mixture with
+        its own `rank`, and only reads the lines of each bitext whose line number modulo
+        `world_size` is `rank`, so the processes train on disjoint data.
+        """
         self.bitexts = bitexts        
         self.keys = list(bitexts)
         self.batch_size = batch_size
+        self.collate_fn = collate_fn
+        self.max_tokens = max_tokens
+        self.shuffle_window = shuffle_window
+        self.lengths_fn = lengths_fn
+        self.rank = rank
+        self.world_size = world_size
+        self.encode_fn = encode_fn
+        self.rng = random.Random(seed) # private generator, so other users of `random` can't shift the batch order
         self.batch_iters = {}
 
         for key in self.keys:
@@ -79,21 +363,42 @@ class MixtureOfBitexts:
         self.completed_bitexts = set()
 
     def _create_iterator(
-        self, key: Tuple[str, str]
-    ) -> Iterator[Tuple[List[str], List[str]]]:
-        return iter(
-            DataLoader(
-                self.bitexts[key],
-                batch_size=self.batch_size,
-                shuffle=False,
-                drop_last=True,
-            )
+        self, key: Tuple[str, str], state: Optional[dict] = None
+    ) -> BatchCursor:
+        bitext = self.bitexts[key]
+        if self.world_size > 1:
+            bitext = Shard(bitext, self.rank, self.world_size)
+        if self.encode_fn is not None: # after sharding, so each process only tokenizes its own lines
+            bitext = EncodedBitext(bitext, self.encode_fn, key)
+        return BatchCursor(
+            bitext,
+            self.batch_size,
+            collate_fn=self.collate_fn,
+            max_tokens=self.max_tokens,
+            shuffle_window=self.shuffle_window,
+            lengths_fn=self.lengths_fn,
+            rng=self.rng,
+            state=state,
         )
 
+    def state_dict(self) -> dict:
+        """Where each bitext's iterator is, and the sampling state, so that batching can be resumed."""
+        return {
+            "rng": self.rng.getstate(),
+            "cursors": {key: self.batch_iters[key].state() for key in self.keys},
+            "completed": sorted(self.completed_bitexts),
+        }
+
+    def load_state_dict(self, state: dict):
+        self.rng.setstate(state["rng"])
+        for key in self.keys:
+            self.batch_iters[key] = self._create_iterator(key, state["cursors"][key])
+        self.completed_bitexts = set(state["completed"])
+
     def next_batch(self) -> Optional[Tuple[List[str], List[str], str, str]]:
         still_choosing = True
         while still_choosing and len(self.completed_bitexts) < len(self.keys):
-            lang_pair = random.choices(self.keys, weights=self.sampling_probs, k=1)[0]
+            lang_pair = self.rng.choices(self.keys, weights=self.sampling_probs, k=1)[0]
             try:
                 lang1_sents, lang2_sents = next(self.batch_iters[lang_pair])                
                 still_choosing = False
@@ -113,13 +418,23 @@ class MixtureOfBitexts:
         lps: List[Tuple[str, str, Optional[Tuple[int, int]]]],
         batch_size: int,
         sampling_probs: Optional[List[float]] = None,
-        only_once_thru: bool = False
+        only_once_thru: bool = False,
+        seed: Optional[int] = None
     ) -> "MixtureOfBitexts":
         bitexts = {(l1, l2): Bitext(text_files[l1], text_files[l2], lines) for (l1, l2, lines) in lps}        
-        return MixtureOfBitexts(bitexts, batch_size, sampling_probs, only_once_thru)
+        return MixtureOfBitexts(bitexts, batch_size, sampling_probs, only_once_thru, seed=seed)
     
     @staticmethod
-    def create_from_config(config: dict, split: str, only_once_thru: bool = False) -> "MixtureOfBitexts":
+    def create_from_config(
+        config: dict, 
+        split: str, 
+        only_once_thru: bool = False, 
+        lengths_fn: Callable[[List[str]], List[int]] = word_counts,
+        rank: int = 0,
+        world_size: int = 1,
+        collate_fn: Optional[Callable] = None,
+        encode_fn: Optional[Callable[[List[str], CorpusId], List[List[int]]]] = None
+    ) -> "MixtureOfBitexts":
         all_corpora = dict()
         for corpus in config['corpora']:
             for key in config['corpora'][corpus]:
@@ -131,13 +446,49 @@ class MixtureOfBitexts:
             lines = bitext["train_lines"] if split == "train" else None
             bitexts[(src, tgt)] = Bitext(all_corpora[src], all_corpora[tgt], lines)
         params = config["finetuning_parameters"]
-        return MixtureOfBitexts(bitexts, params['batch_size'], sampling_probs=None, only_once_thru=only_once_thru)
+        return MixtureOfBitexts(
+            bitexts, 
+            params['batch_size'], 
+            sampling_probs=None, 
+            only_once_thru=only_once_thru, 
+            lengths_fn=lengths_fn, 
+            rank=rank,
+            world_size=world_size,
+            collate_fn=collate_fn,
+            encode_fn=encode_fn,
+            **batching_options(params)
+        )
         
 
     def get_language_codes(self) -> List[str]:
         return sorted({code for pair in self.keys for code in pair})
 
 
+def lang_codes_from_config(config: dict) -> Dict[CorpusId, str]:
+    lang_codes = dict()        
+    for corpus in config['corpora']:
+        for key in config['corpora'][corpus]:
+            lang_codes[(corpus, key)] = config['corpora'][corpus][key]['lang_code']
+    return lang_codes
+
+
+def apply_permutation(input_ids, permutation: Callable[[int], int]):
+    # modifies in-place
+    if hasattr(permutation, "permute"): # a permutations.Permutation
+        input_ids.copy_(permutation.permute(input_ids)) # one gather over the whole batch
+    else:
+        input_ids.apply_(permutation) # calls the function once per token
+
+
+def batching_options(params: dict) -> dict:
+    """Reads the optional batching settings of a config's finetuning_parameters."""
+    options = dict()
+    for param, option in [('seed', 'seed'), ('max_tokens_per_batch', 'max_tokens'), ('shuffle_window', 'shuffle_window')]:
+        if param in params:
+            options[option] = params[param]
+    return options
+
+
 class TokenizedMixtureOfBitexts:
     def __init__(
         self,
@@ -150,22 +501,122 @@ class TokenizedMixtureOfBitexts:
         self.tokenizer = tokenizer
         self.lang_codes = lang_codes
         self.permutation_map = permutation_map
+        self.timings = dict() # seconds spent on each phase of building the last batch (see metrics.py)
 
     def _tokenize(self, sents: List[str], corpus: CorpusId, alt_pad_token: int = None):
+        start_time = time.perf_counter()
         tokens = self.tokenizer(sents, lang_code = self.lang_codes[corpus])
         if alt_pad_token is not None:
             pad_token_id = self.tokenizer.get_special_tokens()['<pad>']
             tokens.input_ids[tokens.input_ids == pad_token_id] = alt_pad_token            
-        if corpus in self.permutation_map: # apply the permutation
-            p = self.permutation_map[corpus]
-            tokens.input_ids.apply_(p) # modifies in-place
+        permute_time = time.perf_counter()
+        if corpus in self.permutation_map: 
+            apply_permutation(tokens.input_ids, self.permutation_map[corpus])
+        self.timings["tokenize"] += permute_time - start_time
+        self.timings["permute"] += time.perf_counter() - permute_time
         return tokens
 
     def next_batch(self):
+        start_time = time.perf_counter()
         batch = self.mixture_of_bitexts.next_batch()
+        self.timings = {"read": time.perf_counter() - start_time, "tokenize": 0.0, "permute": 0.0}
         if batch is None:
             return None
         lang1_sents, lang2_sents, lang1, lang2 = batch
         lang1_tokenized = self._tokenize(lang1_sents, lang1)
         lang2_tokenized = self._tokenize(lang2_sents, lang2, alt_pad_token=-100)
         return lang1_tokenized, lang2_tokenized, lang1, lang2
+
+    def state_dict(self) -> dict:
+        return self.mixture_of_bitexts.state_dict()
+
+    def load_state_dict(self, state: dict):
+        self.mixture_of_bitexts.load_state_dict(state)
+
+
+def materialize_batches(batches, max_batches: int, pin_memory: bool = False) -> List[Tuple]:
+    """
+    Reads up to `max_batches` batches from a tokenized mixture of bitexts (stopping early if it
+    runs out), so that the same tokenized and permuted tensors can be reused, e.g. for every
+    validation. With `pin_memory`, the tensors are pinned for faster copies to the GPU.
+    """
+    materialized = []
+    while len(materialized) < max_batches:
+        batch = batches.next_batch()
+        if batch is None:
+            break
+        x, y, lang1, lang2 = batch
+        if pin_memory:
+            for tokens in [x, y]:
+                for field in tokens:
+                    tokens[field] = tokens[field].pin_memory()
+        materialized.append((x, y, lang1, lang2))
+    return materialized
+
+
+class PrefetchingBatchProducer:
+    """
+    Builds upcoming batches of a (tokenized) mixture of bitexts on a background thread.
+
+    Up to `num_batches` finished batches wait in a bounded queue, so file reading,
+    collation, tokenization and permutation overlap with the training step. Batches come
+    out in exactly the order the wrapped object would produce them. An exception raised
+    while building a batch is re-raised by the `next_batch` call that would have returned it.
+    `state_dict` describes the wrapped object as of the last batch handed out, not as of the
+    last batch built, so batches still waiting in the queue are produced again on resumption.
+    """
+
+    def __init__(self, batches, num_batches: int = 8):
+        self.batches = batches
+        self.state = self._inner_state()
+        self.queue = queue.Queue(maxsize=num_batches)
+        self.stop_event = threading.Event()
+        self.exhausted = False
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+
+    def _produce(self):
+        try:
+            batch = "not none"
+            while batch is not None and not self.stop_event.is_set():
+                batch = self.batches.next_batch()
+                self._put((batch, self._inner_state(), None))
+        except BaseException as e:
+            self._put((None, None, e))
+
+    def _inner_state(self) -> Optional[dict]:
+        return self.batches.state_dict() if hasattr(self.batches, "state_dict") else None
+
+    def _put(self, item):
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def next_batch(self):
+        if self.exhausted:
+            return None
+        batch, state, error = self.queue.get()
+        if error is not None:
+            self.close()
+            raise error
+        if batch is None:
+            self.exhausted = True
+        self.state = state
+        return batch
+
+    def state_dict(self) -> dict:
+        return self.state
+
+    def close(self):
+        self.exhausted = True
+        self.stop_event.set()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,159 @@
+"""
+Checks an experiment config and estimates the size of its training data, without loading the
+model or the tokenizer:
+
+    python finetune.py --dry-run --config examples/example1.json
+
+Every corpus file must exist, the files of each corpus must have the same number of lines in
+each split, and the `train_lines` of each bitext must lie within its files. Token counts are
+exact for files compiled into the config's `compiled_corpora` (see pretokenized.py), and are
+whitespace-separated word counts otherwise (subword tokenizers produce more tokens than that).
+"""
+
+import glob
+import os
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from corpora import LineIndex, stream_lines
+from pretokenized import TokenizedText, file_digest
+
+REQUIRED_PARAMS = ["base_model", "batch_size", "num_steps", "report_every", "validate_every", "patience"]
+SPLITS = ["train", "dev", "test"]
+MAX_LENGTH = 128  # the max_length of the tokenizer of finetune.py, which compiled corpora are keyed by
+
+
+def check_config(config: dict) -> List[str]:
+    """Returns a description of every problem found in the config (an empty list if there are none)."""
+    errors = []
+    for key in ["corpora", "bitexts", "finetuning_parameters"]:
+        if key not in config:
+            errors.append(f"missing '{key}'")
+    if len(errors) > 0:
+        return errors
+    params = config["finetuning_parameters"]
+    errors.extend(f"missing finetuning parameter '{param}'" for param in REQUIRED_PARAMS if param not in params)
+
+    num_lines = dict()  # file path => number of lines
+    for corpus, languages in config["corpora"].items():
+        for split in SPLITS:
+            split_lines = dict()
+            for key, corpus_config in languages.items():
+                if split not in corpus_config:
+                    errors.append(f"{corpus}/{key}: no '{split}' file")
+                elif not os.path.isfile(corpus_config[split]):
+                    errors.append(f"{corpus}/{key}: {split} file {corpus_config[split]} does not exist")
+                else:
+                    num_lines[corpus_config[split]] = len(LineIndex.for_file(corpus_config[split]))
+                    split_lines[key] = num_lines[corpus_config[split]]
+            if len(set(split_lines.values())) > 1:
+                counts = ", ".join(f"{key}: {count}" for key, count in split_lines.items())
+                errors.append(f"{corpus}: {split} files are not line-aligned ({counts} lines)")
+        for key, corpus_config in languages.items():
+            if "lang_code" not in corpus_config:
+                errors.append(f"{corpus}/{key}: no 'lang_code'")
+
+    for bitext in config["bitexts"]:
+        name = f"{bitext.get('corpus')}:{bitext.get('src')}->{bitext.get('tgt')}"
+        languages = config["corpora"].get(bitext.get("corpus"))
+        if languages is None or bitext.get("src") not in languages or bitext.get("tgt") not in languages:
+            errors.append(f"bitext {name}: not in 'corpora'")
+            continue
+        if "train_lines" not in bitext:
+            errors.append(f"bitext {name}: no 'train_lines'")
+            continue
+        if bitext["train_lines"] is None: # all lines of the files
+            continue
+        start, end = bitext["train_lines"]
+        if not 0 <= start < end:
+            errors.append(f"bitext {name}: train_lines [{start}, {end}] is empty or negative")
+        for key in [bitext["src"], bitext["tgt"]]:
+            train_file = languages[key].get("train")
+            if train_file in num_lines and end > num_lines[train_file]:
+                errors.append(
+                    f"bitext {name}: train_lines [{start}, {end}] goes past the end of "
+                    f"{train_file} ({num_lines[train_file]} lines)"
+                )
+    return errors
+
+
+def compiled_lengths(compiled_dir: str, model_name: str, lang_code: str, text_file: str) -> Optional[np.ndarray]:
+    """Token counts of every line of a text file, if it was compiled for the model's tokenizer (and only one)."""
+    model_key = str(model_name).strip("/").replace("/", "--")
+    tokenizer_dirs = Path(glob.escape(compiled_dir)) / f"{glob.escape(model_key)}.max{MAX_LENGTH}.*"
+    pattern = tokenizer_dirs / lang_code / file_digest(text_file)
+    prefixes = [path[: -len(".offsets")] for path in glob.glob(f"{pattern}.offsets")]
+    if len(prefixes) != 1:
+        return None
+    return TokenizedText(prefixes[0]).lengths()
+
+
+def line_lengths(config: dict, corpus: str, key: str, lines: Optional[List[int]]) -> Tuple[np.ndarray, str]:
+    """
+    The token (or else word) count of each training line of one side of a bitext, and which it
+    is. `lines` is the bitext's `train_lines`; None means every line of the file.
+    """
+    params = config["finetuning_parameters"]
+    corpus_config = config["corpora"][corpus][key]
+    start, end = lines if lines is not None else (0, None)
+    if "compiled_corpora" in params:
+        lengths = compiled_lengths(
+            params["compiled_corpora"], params["base_model"], corpus_config["lang_code"], corpus_config["train"]
+        )
+        if lengths is not None:
+            return lengths[start:end], "tokens"
+    words = (len(line.split()) for line in stream_lines(corpus_config["train"], start, end))
+    return np.fromiter(words, dtype=np.int64), "words"
+
+
+def bitext_statistics(config: dict) -> List[dict]:
+    """The number of training lines and tokens (or words) of each bitext of a valid config."""
+    statistics = []
+    for bitext in config["bitexts"]:
+        src_lengths, src_unit = line_lengths(config, bitext["corpus"], bitext["src"], bitext["train_lines"])
+        tgt_lengths, tgt_unit = line_lengths(config, bitext["corpus"], bitext["tgt"], bitext["train_lines"])
+        statistics.append({
+            "bitext": f"{bitext['corpus']}:{bitext['src']}->{bitext['tgt']}",
+            "lines": len(src_lengths),
+            "src_tokens": int(src_lengths.sum()),
+            "tgt_tokens": int(tgt_lengths.sum()),
+            "unit": "tokens" if src_unit == tgt_unit == "tokens" else "words",
+        })
+    return statistics
+
+
+def tokens_per_step(config: dict, statistics: List[dict]) -> float:
+    """
+    Expected number of (unpadded) source plus target tokens per training step and process:
+    bitexts are sampled uniformly, and each step trains on `grad_accum_steps` batches.
+    """
+    params = config["finetuning_parameters"]
+    grad_accum_steps = params["grad_accum_steps"] if "grad_accum_steps" in params else 1
+    per_line = [(s["src_tokens"] + s["tgt_tokens"]) / s["lines"] for s in statistics if s["lines"] > 0]
+    if len(per_line) == 0:
+        return 0.0
+    estimate = np.mean(per_line) * params["batch_size"] * grad_accum_steps
+    if "max_tokens_per_batch" in params: # batches hold at most this many tokens, padding included
+        estimate = min(estimate, params["max_tokens_per_batch"] * grad_accum_steps)
+    return float(estimate)
+
+
+def dry_run(config: dict) -> bool:
+    """Prints the problems of a config, or the size of its training data. Returns whether the config is valid."""
+    errors = check_config(config)
+    if len(errors) > 0:
+        print(f"Found {len(errors)} problems:")
+        for error in errors:
+            print(f"  {error}")
+        return False
+    statistics = bitext_statistics(config)
+    for s in statistics:
+        print(f"{s['bitext']}: {s['lines']} lines, {s['src_tokens']} + {s['tgt_tokens']} {s['unit']}")
+    params = config["finetuning_parameters"]
+    unit = "tokens" if all(s["unit"] == "tokens" for s in statistics) else "words"
+    per_step = tokens_per_step(config, statistics)
+    print(f"About {per_step:.0f} {unit} per step (per process), {per_step * params['num_steps']:.0f} over {params['num_steps']} steps.")
+    print("Config OK.")
+    return True
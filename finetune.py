@@ -1,41 +1,53 @@
 import argparse
+import contextlib
 import gc
 import json
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 from pathlib import Path
 import shutil
 import sys
-import torch
-from tqdm import tqdm
-from transformers import (
-    Adafactor,
-    AutoModelForSeq2SeqLM,
-    AutoConfig,
-    get_constant_schedule_with_warmup,
+from corpora import (
+    MixtureOfBitexts,
+    PrefetchingBatchProducer,
+    TokenizedMixtureOfBitexts,
+    lang_codes_from_config,
+    materialize_batches,
 )
-from configure import USE_CUDA
-from corpora import MixtureOfBitexts, TokenizedMixtureOfBitexts
-from permutations import (
-    create_random_permutation_with_fixed_points,
-    save_permutation_map,
-)
-from validate import translate_tokenized_mixture_of_bitexts, evaluate_translations
-from tokenization import NllbTokenizer, HuggingfaceTokenizer
+# torch, transformers, matplotlib and the modules that depend on them are imported by the
+# functions that use them, so that commands which never train start quickly
 
 
 def cleanup():
+    import torch
+
     gc.collect()
     torch.cuda.empty_cache()
 
 
-def prepare_model(base_model: str, freeze_decoder: bool, freeze_encoder: bool, should_finetune: bool, should_resize: bool, tokenizer):
+MIXED_PRECISION_DTYPES = {"bf16": "bfloat16", "fp16": "float16"}  # names of torch dtypes
+
+
+def prepare_model(base_model: str, freeze_decoder: bool, freeze_encoder: bool, should_finetune: bool, should_resize: bool, tokenizer, mixed_precision: str = None, base_models: dict = None):
+    """
+    Pretrained weights are memory-mapped when possible (see model_loading.py), so frozen
+    parameters share memory with every other run of the same base model. `base_models`, if
+    given, caches what was loaded by name, for processes that train several models.
+    """
+    import torch
+    from transformers import AutoConfig, AutoModelForSeq2SeqLM
+    from configure import USE_CUDA
+    from model_loading import load_pretrained, unshare_trainable_parameters
+    from parallel import get_local_rank
+
+    if mixed_precision is not None and mixed_precision not in MIXED_PRECISION_DTYPES:
+        raise ValueError(f"Unknown mixed precision mode: {mixed_precision} (expected one of {list(MIXED_PRECISION_DTYPES)})")
+    if mixed_precision == "bf16" and USE_CUDA and not torch.cuda.is_bf16_supported():
+        raise ValueError("This GPU does not support bf16; use fp16 instead.")
+    mapped = False
     if should_finetune:
-        model = AutoModelForSeq2SeqLM.from_pretrained(base_model) 
-        print('loaded pretrained model')
+        model, mapped = load_pretrained(base_model, cache=base_models)
+        print('loaded pretrained model' + (' (memory-mapped)' if mapped else ''))
     else: 
         model_config = AutoConfig.from_pretrained(base_model)
         model = AutoModelForSeq2SeqLM.from_config(model_config)
@@ -56,26 +68,60 @@ def prepare_model(base_model: str, freeze_decoder: bool, freeze_encoder: bool, s
             param.requires_grad = False
     else:
         print("--> encoder NOT frozen <--")
+    if mapped: # only what will be trained gets its own copy
+        unshare_trainable_parameters(model)
     if USE_CUDA:
-        torch.cuda.set_device(0)
+        torch.cuda.set_device(get_local_rank())
         model.cuda()
     return model
 
 
-def evaluate(model, dev_data, batches: int = 100):
+def synchronizing(train_model, sync: bool):
+    """With data parallelism, skips the gradient all-reduce of a backward pass unless `sync`."""
+    from torch.nn.parallel import DistributedDataParallel
+
+    if sync or not isinstance(train_model, DistributedDataParallel):
+        return contextlib.nullcontext()
+    return train_model.no_sync()
+
+
+def count_tokens(x, y):
+    """Returns the number of tokens (source plus target, padding included) in a batch, and how many are padding."""
+    num_tokens = x.input_ids.numel() + y.input_ids.numel()
+    num_real_tokens = int(x.attention_mask.sum()) + int(y.attention_mask.sum())
+    return num_tokens, num_tokens - num_real_tokens
+
+
+def autocast(model, mixed_precision: str = None):
+    """Runs the forward pass in bf16 or fp16 (the weights stay in fp32), on GPU or CPU."""
+    import torch
+
+    if mixed_precision is None:
+        return contextlib.nullcontext()
+    dtype = getattr(torch, MIXED_PRECISION_DTYPES[mixed_precision])
+    return torch.autocast(device_type=model.device.type, dtype=dtype)
+
+
+def evaluate(model, dev_batches, mixed_precision: str = None):
+    import torch
+
     model.eval()
     dev_losses = []
     with torch.no_grad():
-        for _ in range(batches):
-            x, y, _, _ = dev_data.next_batch()
+        for x, y, _, _ in dev_batches:
             x = x.to(model.device)
             y = y.to(model.device)
-            loss = model(**x, labels=y.input_ids).loss
+            with autocast(model, mixed_precision):
+                loss = model(**x, labels=y.input_ids).loss
             dev_losses.append(loss.item())
     return np.mean(dev_losses)
 
 
 def plot_losses(train_x, train_y, dev_x, dev_y, out_path: str):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
     plt.clf()
     plt.plot(train_x, train_y, label="train", color="blue", linewidth=2)
     plt.plot(dev_x, dev_y, label="dev", color="red", linewidth=2)
@@ -88,7 +134,7 @@ def plot_losses(train_x, train_y, dev_x, dev_y, out_path: str):
 
 def finetune(
     train_data,
-    dev_data,
+    dev_batches,
     tokenizer,
     base_model: str,
     model_dir: str,
@@ -99,10 +145,60 @@ def finetune(
     freeze_decoder: bool = False,
     freeze_encoder: bool = False,
     should_finetune: bool = True,
-    should_resize: bool = False
+    should_resize: bool = False,
+    checkpoint_every: int = 0,
+    resume_state: dict = None,
+    config: dict = None,
+    grad_accum_steps: int = 1,
+    mixed_precision: str = None,
+    base_models: dict = None,
+    profile_phases: bool = False
 ):
-    print(f"Training {model_dir}")
-    model = prepare_model(base_model, freeze_decoder, freeze_encoder, should_finetune, should_resize, tokenizer)
+    """
+    Each training step accumulates the gradients of `grad_accum_steps` batches before updating
+    the weights, so the effective batch is `grad_accum_steps` times larger. With
+    `mixed_precision` ("bf16" or "fp16"), forward passes run under autocast; fp16 losses are
+    scaled to avoid gradient underflow. With `profile_phases`, the GPU is synchronized at the
+    end of every timed phase, so that the reported time of each phase includes its GPU work.
+
+    If torch.distributed is initialized, every rank runs this function on its own shard of the
+    training data, and gradients are all-reduced before each update. Only rank 0 evaluates,
+    plots and saves; it broadcasts the early stopping decision to the other ranks.
+
+    Every `checkpoint_every` steps (and when training ends), a resumable checkpoint is written
+    to `model_dir` (see checkpointing.py). To continue from one, pass the training state
+    returned by `load_checkpoint` as `resume_state`, with `train_data` already restored to the
+    data state it contains.
+    """
+    import torch
+    from torch.nn.parallel import DistributedDataParallel
+    from tqdm import tqdm
+    from transformers import Adafactor, get_constant_schedule_with_warmup
+    from checkpointing import (
+        CheckpointWriter,
+        checkpoint_path,
+        random_states,
+        restore_random_states,
+        save_checkpoint,
+        save_model,
+    )
+    from configure import USE_CUDA
+    from metrics import PhaseTimer, append_metrics, format_report
+    from parallel import broadcast_object, gather_objects, get_local_rank, get_rank, get_world_size
+
+    rank, world_size = get_rank(), get_world_size()
+    is_main = rank == 0
+    print(f"Training {model_dir}" + (f" (rank {rank} of {world_size})" if world_size > 1 else ""))
+    if resume_state is not None:
+        print(f"Resuming from step {resume_state['step']}")
+        model = prepare_model(
+            str(checkpoint_path(model_dir)), freeze_decoder, freeze_encoder, True, False, tokenizer, mixed_precision
+        )
+    else:
+        model = prepare_model(
+            base_model, freeze_decoder, freeze_encoder, should_finetune, should_resize, tokenizer, mixed_precision,
+            base_models
+        )
     
     if should_finetune:
         optimizer = Adafactor(
@@ -124,145 +220,270 @@ def finetune(
             weight_decay=0.01,  
         )
         scheduler = None
+    # a no-op unless fp16, where it scales the loss before backward and unscales before Adafactor steps
+    scaler = torch.amp.GradScaler(model.device.type, enabled=mixed_precision == "fp16")
         
     cleanup()
     train_losses, train_plot_x, train_plot_y = [], [], []
+    step_tokens, step_pad_tokens, oom_steps = [], [], 0
+    num_tokens, num_pad_tokens = 0, 0
     dev_plot_x, dev_plot_y = [], []
     best_dev_loss, steps_since_best = None, 0
+    start_step, finished = 0, False
+    if resume_state is not None:
+        optimizer.load_state_dict(resume_state["optimizer"])
+        if scheduler is not None:
+            scheduler.load_state_dict(resume_state["scheduler"])
+        scaler.load_state_dict(resume_state["scaler"])
+        train_losses, train_plot_x, train_plot_y = resume_state["train_history"]
+        step_tokens, step_pad_tokens, oom_steps = resume_state["token_history"]
+        dev_plot_x, dev_plot_y = resume_state["dev_history"]
+        best_dev_loss, steps_since_best = resume_state["best_dev_loss"], resume_state["steps_since_best"]
+        start_step, finished = resume_state["step"], resume_state["finished"]
+        restore_random_states(resume_state["random"][rank])
 
-    for i in tqdm(range(training_steps)):
+    train_model = model
+    if world_size > 1:
+        train_model = DistributedDataParallel(model, device_ids=[get_local_rank()] if USE_CUDA else None)
+    # saves run on a background thread, off the training loop
+    checkpoint_writer = CheckpointWriter() if is_main else None
+
+    def checkpoint(step: int):
+        data_states, rng_states = gather_objects(train_data.state_dict()), gather_objects(random_states())
+        if not is_main:
+            return
+        save_checkpoint(model_dir, model, {
+            "step": step,
+            "finished": finished,
+            "optimizer": optimizer.state_dict(),
+            "scheduler": scheduler.state_dict() if scheduler is not None else None,
+            "scaler": scaler.state_dict(),
+            "train_history": (train_losses, train_plot_x, train_plot_y),
+            "token_history": (step_tokens, step_pad_tokens, oom_steps),
+            "dev_history": (dev_plot_x, dev_plot_y),
+            "best_dev_loss": best_dev_loss,
+            "steps_since_best": steps_since_best,
+            "random": rng_states, # per rank
+            "data": data_states, # per rank
+            "world_size": world_size,
+            "config": config,
+        }, writer=checkpoint_writer)
+
+    # time spent in each phase of training, and tokens per second, reported every report_every steps
+    timer = PhaseTimer(synchronize=torch.cuda.synchronize if USE_CUDA else None, sync_phases=profile_phases)
+    steps = range(start_step, training_steps)
+    for i in tqdm(steps, initial=start_step, total=training_steps) if is_main else steps:
+        if finished:
+            break
         try:
             model.train()
-            x, y, _, _ = train_data.next_batch()
-            x = x.to(model.device)
-            y = y.to(model.device)
-            loss = model(**x, labels=y.input_ids).loss
-            loss.backward()
-            train_losses.append(loss.item())
-            optimizer.step()
-            optimizer.zero_grad(set_to_none=True)
-            if scheduler is not None:
-                scheduler.step()
+            step_loss, num_tokens, num_pad_tokens = 0.0, 0, 0
+            for micro_step in range(grad_accum_steps):
+                with timer.phase("data"):
+                    x, y, _, _ = train_data.next_batch()
+                if hasattr(train_data, "timings"): # reading, tokenization and permutation (unless prefetched)
+                    timer.split("data", train_data.timings)
+                batch_tokens, batch_pad_tokens = count_tokens(x, y)
+                num_tokens += batch_tokens
+                num_pad_tokens += batch_pad_tokens
+                with timer.phase("to_device"):
+                    x = x.to(model.device)
+                    y = y.to(model.device)
+                with synchronizing(train_model, sync=micro_step == grad_accum_steps - 1):
+                    with timer.phase("forward"), autocast(model, mixed_precision):
+                        loss = train_model(**x, labels=y.input_ids).loss / grad_accum_steps
+                    with timer.phase("backward"):
+                        scaler.scale(loss).backward()
+                step_loss += loss.item()
+            train_losses.append(step_loss)
+            step_tokens.append(num_tokens)
+            step_pad_tokens.append(num_pad_tokens)
+            with timer.phase("optimizer"):
+                scaler.step(optimizer)
+                scaler.update()
+                optimizer.zero_grad(set_to_none=True)
+                if scheduler is not None:
+                    scheduler.step()
+            timer.end_step(num_tokens, num_pad_tokens)
         except RuntimeError as e:
-            if "out of memory" in str(e):
-                print("GPU OOM. Cleaning up.")
+            if "out of memory" in str(e) and world_size == 1: # a rank can't skip a step the others take
+                print(f"GPU OOM at step {i} ({num_tokens} tokens, {num_pad_tokens} padding). Cleaning up.")
+                oom_steps += 1
                 optimizer.zero_grad(set_to_none=True)
                 cleanup()
                 continue
             else:
                 raise e
 
-        if i > 0 and i % report_every == 0:
+        if is_main and i > 0 and i % report_every == 0:
             avg_train_loss = np.mean(train_losses[-report_every:])
-            print(f"Step {i} (train): {avg_train_loss:.4f}")
+            avg_tokens = np.mean(step_tokens[-report_every:])
+            avg_pad_tokens = np.mean(step_pad_tokens[-report_every:])
+            metrics = timer.report(i)
+            print(
+                f"Step {i} (train): {avg_train_loss:.4f} "
+                f"[{avg_tokens:.0f} tokens/step, {avg_pad_tokens:.0f} of them padding; {oom_steps} OOM steps skipped]"
+            )
+            print(f"  {format_report(metrics)}")
+            append_metrics(model_dir, {"train_loss": avg_train_loss, "oom_steps": oom_steps, **metrics})
             train_plot_x.append(i)
             train_plot_y.append(avg_train_loss)
             sys.stdout.flush()
 
-        if i > 0 and i % validate_every == 0:
-            print("Validating...")
-            dev_loss = evaluate(model, dev_data)
-            print(f"Dev loss: {dev_loss:.4f}")
-            dev_plot_x.append(i)
-            dev_plot_y.append(dev_loss)
-            sys.stdout.flush()
+        if is_main and i > 0 and i % validate_every == 0:
+            with timer.phase("validate"): # including plotting and saving the best model
+                print("Validating...")
+                dev_loss = evaluate(model, dev_batches, mixed_precision)
+                print(f"Dev loss: {dev_loss:.4f}")
+                dev_plot_x.append(i)
+                dev_plot_y.append(dev_loss)
+                sys.stdout.flush()
 
-            plot_losses(
-                train_plot_x,
-                train_plot_y,
-                dev_plot_x,
-                dev_plot_y,
-                os.path.join(model_dir, "training.png"),
-            )
+                plot_losses(
+                    train_plot_x,
+                    train_plot_y,
+                    dev_plot_x,
+                    dev_plot_y,
+                    os.path.join(model_dir, "training.png"),
+                )
 
-            if best_dev_loss is None or dev_loss < best_dev_loss:
-                print("Saving new best model.")
-                best_dev_loss = dev_loss
-                steps_since_best = 0
-                model.save_pretrained(model_dir)  # causes warning?
-            else:
-                steps_since_best += 1
-                print(f"No improvement. Patience: {patience - steps_since_best}")
-                if steps_since_best >= patience:
-                    print("Early stopping.")
-                    break
+                if best_dev_loss is None or dev_loss < best_dev_loss:
+                    print("Saving new best model.")
+                    best_dev_loss = dev_loss
+                    steps_since_best = 0
+                    save_model(model, model_dir, writer=checkpoint_writer)
+                else:
+                    steps_since_best += 1
+                    print(f"No improvement. Patience: {patience - steps_since_best}")
+                    if steps_since_best >= patience:
+                        print("Early stopping.")
+                        finished = True
 
+        if i > 0 and i % validate_every == 0 and broadcast_object(finished):
+            finished = True
+            break
 
-def main():
-    parser = argparse.ArgumentParser(description="Finetune NLLB model.")
-    parser.add_argument(
-        "--config", type=str, required=True, help="Directory to save finetuned model"
-    )
-    args = parser.parse_args()
+        if checkpoint_every > 0 and (i + 1) % checkpoint_every == 0:
+            with timer.phase("checkpoint"):
+                checkpoint(i + 1)
 
-    with open(args.config) as reader:
-        config = json.load(reader)
+    if checkpoint_every > 0 and not (resume_state is not None and resume_state["finished"]):
+        finished = True
+        checkpoint(training_steps)
+    if is_main:
+        checkpoint_writer.close()
 
-    all_corpora = config["corpora"]
-    params = config["finetuning_parameters"]
-    should_finetune = params["finetune"] if "finetune" in params else True
-    
-    # Create unique model directory
+
+def create_model_dir(config: dict, config_path: str) -> str:
+    """Creates the first unused versioned directory ``<model_dir>-v<n>`` and copies the config into it."""
     base_dir = config["model_dir"]
     model_version = 0
     while os.path.exists(f"{base_dir}-v{model_version}"):
         model_version += 1
     model_dir = f"{base_dir}-v{model_version}"
     os.makedirs(model_dir)
-    shutil.copy(args.config, Path(model_dir) / Path(args.config).name)
+    shutil.copy(config_path, Path(model_dir) / Path(config_path).name)
+    return model_dir
 
-    lang_codes = dict()        
-    for corpus in config['corpora']:
-        for key in config['corpora'][corpus]:
-            lang_codes[(corpus, key)] = config['corpora'][corpus][key]['lang_code']
-    
-    
 
-    train_data = MixtureOfBitexts.create_from_config(config, "train", only_once_thru=False)    
-    dev_data = MixtureOfBitexts.create_from_config(config, "dev", only_once_thru=False)
+def run_experiment(
+    config: dict,
+    model_dir: str,
+    resume_state: dict = None,
+    tokenizers: dict = None,
+    base_models: dict = None
+):
+    """
+    Trains the model of an experiment in `model_dir`, then translates and scores its test sets.
+    `tokenizers` and `base_models`, if given, cache what is loaded, for processes that run
+    several experiments (see sweep.py).
+    """
+    from transformers import AutoModelForSeq2SeqLM
+    from checkpointing import remove_checkpoint
+    from configure import USE_CUDA
+    from parallel import barrier, get_rank, get_world_size, shutdown_distributed
+    from permutations import create_random_permutation_with_fixed_points, load_permutation_map, save_permutation_map
+    from pretokenized import PretokenizedMixtureOfBitexts
+    from tokenization import prepare_tokenizer
+    from translation_cache import open_cache, saved_model_fingerprint
+    from validate import TranslationScorer, collect_references, translate_bitexts
+
+    all_corpora = config["corpora"]
+    params = config["finetuning_parameters"]
+    should_finetune = params["finetune"] if "finetune" in params else True
+    rank, world_size = get_rank(), get_world_size()
+
+    lang_codes = lang_codes_from_config(config)
     model_name = params["base_model"]
-    if model_name == "facebook/nllb-200-distilled-600M":   
-        tokenizer = NllbTokenizer("600M", max_length=128) # set max length?
-    elif model_name == "facebook/nllb-200-distilled-1.3B": 
-        tokenizer = NllbTokenizer("1.3B", max_length=128)
-        
-    #Check if new languages need to be added
-    special_tokens = list(tokenizer.get_special_tokens().keys())
-    cur_langs = set(special_tokens)
-    input_langs = set(lang_codes.values()) 
-    langs_to_add = list(input_langs - cur_langs)
-    resize = (len(langs_to_add) > 0)
-    if resize:
-        print(f"Adding unrecognized lang codes: {langs_to_add}")
-
-    new_special_tokens = special_tokens + langs_to_add
-    tokenizer.replace_special_tokens(new_special_tokens)
-
-    # Create the permutations
-    permutations = dict()
-    pmap = dict()
-    for corpus in all_corpora:
-        for language in all_corpora[corpus]:
-            permutation_index = all_corpora[corpus][language]["permutation"]
-            if permutation_index > 0:
-                if permutation_index not in permutations:
-                    permutations[permutation_index] = (
-                        create_random_permutation_with_fixed_points(
-                            len(tokenizer), list(tokenizer.get_special_tokens().values())
+    tokenizer_key = (model_name, tuple(sorted(set(lang_codes.values()))))
+    if tokenizers is not None and tokenizer_key in tokenizers:
+        tokenizer, resize = tokenizers[tokenizer_key]
+    else:
+        tokenizer, resize = prepare_tokenizer(model_name, lang_codes.values(), max_length=128)
+        if tokenizers is not None:
+            tokenizers[tokenizer_key] = (tokenizer, resize)
+
+    if resume_state is None and rank == 0:
+        # Create the permutations
+        permutations = dict()
+        pmap = dict()
+        for corpus in all_corpora:
+            for language in all_corpora[corpus]:
+                permutation_index = all_corpora[corpus][language]["permutation"]
+                if permutation_index > 0:
+                    if permutation_index not in permutations:
+                        permutations[permutation_index] = (
+                            create_random_permutation_with_fixed_points(
+                                len(tokenizer), list(tokenizer.get_special_tokens().values())
+                            )
                         )
-                    )
-                pmap[(corpus, language)] = permutations[permutation_index]
-        
-    save_permutation_map(pmap, Path(model_dir) / "permutations.json")
-    tokenized_train = TokenizedMixtureOfBitexts(
-        train_data, tokenizer, lang_codes=lang_codes, permutation_map=pmap
-    )
-    tokenized_dev = TokenizedMixtureOfBitexts(
-        dev_data, tokenizer, lang_codes=lang_codes, permutation_map=pmap
-    )
+                    pmap[(corpus, language)] = permutations[permutation_index]
+        save_permutation_map(pmap, Path(model_dir) / "permutations.bin")
+    barrier()
+    if resume_state is not None or rank != 0:
+        pmap = load_permutation_map(Path(model_dir) / "permutations.bin")
+    if "compiled_corpora" in params: # serve batches from pre-tokenized corpora (see pretokenized.py)
+        tokenized_train = PretokenizedMixtureOfBitexts.create_from_config(
+            config, "train", tokenizer, params["compiled_corpora"], permutation_map=pmap,
+            rank=rank, world_size=world_size
+        )
+        tokenized_dev = PretokenizedMixtureOfBitexts.create_from_config(
+            config, "dev", tokenizer, params["compiled_corpora"], permutation_map=pmap, only_once_thru=True
+        )
+    elif "max_tokens_per_batch" in params:
+        # batches are sized by their exact (padded) token counts, so each line is tokenized as it
+        # is read, and its ids are used both for its length and for its batch
+        tokenized_train = PretokenizedMixtureOfBitexts.create_from_text(
+            config, "train", tokenizer, permutation_map=pmap, rank=rank, world_size=world_size
+        )
+        tokenized_dev = PretokenizedMixtureOfBitexts.create_from_text(
+            config, "dev", tokenizer, permutation_map=pmap, only_once_thru=True
+        )
+    else:
+        train_data = MixtureOfBitexts.create_from_config(
+            config, "train", only_once_thru=False, rank=rank, world_size=world_size
+        )    
+        dev_data = MixtureOfBitexts.create_from_config(config, "dev", only_once_thru=True)
+        tokenized_train = TokenizedMixtureOfBitexts(
+            train_data, tokenizer, lang_codes=lang_codes, permutation_map=pmap
+        )
+        tokenized_dev = TokenizedMixtureOfBitexts(
+            dev_data, tokenizer, lang_codes=lang_codes, permutation_map=pmap
+        )
+    # every validation uses the same dev batches, tokenized and permuted only once (by rank 0, which validates)
+    dev_batches = []
+    if rank == 0:
+        dev_batches = materialize_batches(
+            tokenized_dev, params['dev_batches'] if 'dev_batches' in params else 100, pin_memory=USE_CUDA
+        )
+    if resume_state is not None: # skip the batches that were trained on before the checkpoint
+        tokenized_train.load_state_dict(resume_state["data"][rank])
+    prefetch_batches = params['prefetch_batches'] if 'prefetch_batches' in params else 0
+    if prefetch_batches > 0: # build upcoming training batches on a background thread
+        tokenized_train = PrefetchingBatchProducer(tokenized_train, num_batches=prefetch_batches)
     finetune(
         tokenized_train,
-        tokenized_dev,
+        dev_batches,
         tokenizer, 
         model_name,
         model_dir,
@@ -273,44 +494,120 @@ def main():
         should_resize= resize,
         report_every=params['report_every'],
         validate_every=params['validate_every'],
-        patience=params['patience']
+        patience=params['patience'],
+        # a resumed job keeps checkpointing at every validation unless its config says otherwise
+        checkpoint_every=params['checkpoint_every'] if 'checkpoint_every' in params else (
+            params['validate_every'] if resume_state is not None else 0
+        ),
+        resume_state=resume_state,
+        config=config,
+        grad_accum_steps=params['grad_accum_steps'] if 'grad_accum_steps' in params else 1,
+        mixed_precision=params['mixed_precision'] if 'mixed_precision' in params else None,
+        base_models=base_models,
+        profile_phases=params['profile_phases'] if 'profile_phases' in params else False
     )
+    if prefetch_batches > 0:
+        tokenized_train.close()
+    shutdown_distributed()
+    if rank != 0: # rank 0 alone translates and scores the test sets
+        return
 
     test_data = MixtureOfBitexts.create_from_config(config, "test", only_once_thru=True)    
-    tokenized_test = TokenizedMixtureOfBitexts(test_data, tokenizer, lang_codes=lang_codes, permutation_map=pmap)
     model = AutoModelForSeq2SeqLM.from_pretrained(model_dir)
     if USE_CUDA:
         model.cuda()
-    translations = translate_tokenized_mixture_of_bitexts(
-        tokenized_test, model, tokenizer, lang_codes, pmap
+    cache = open_cache(
+        params['translation_cache'] if 'translation_cache' in params else None,
+        max_megabytes=params['translation_cache_mb'] if 'translation_cache_mb' in params else 1024
+    )
+    translations = translate_bitexts(
+        test_data.bitexts, 
+        model, 
+        tokenizer, 
+        lang_codes, 
+        pmap, 
+        max_tokens=params['translation_max_tokens'] if 'translation_max_tokens' in params else 2048,
+        cache=cache,
+        fingerprint=saved_model_fingerprint(model_dir) if cache is not None else None
     )
+    if cache is not None:
+        cache.close()
     with open(Path(model_dir) / "translations.json", "w") as writer:
         json.dump(translations, writer)
     print("Translations complete.")
 
-    test_data = MixtureOfBitexts.create_from_config(config, "test", only_once_thru=True)    
-    references = dict()
-    batch = test_data.next_batch()
-    while batch is not None:
-        _, tgt, src_lang, tgt_lang = batch
-        src_code = lang_codes[src_lang]
-        tgt_code = lang_codes[tgt_lang]
-        key = '->'.join([src_code, tgt_code])
-        if key not in references:
-            references[key] = []
-        references[key].extend(tgt)
-        batch = test_data.next_batch()
+    references = collect_references(test_data.bitexts, lang_codes)
     with open(Path(model_dir) / "references.json", "w") as writer:
         json.dump(references, writer)
     print("References complete.")
 
-    scores = dict()
-    for key in translations:
-        scores[key] = evaluate_translations(translations[key], references[key])
+    scorer = TranslationScorer(
+        sentence_scores=params['sentence_scores'] if 'sentence_scores' in params else False,
+        bootstrap_samples=params['bootstrap_samples'] if 'bootstrap_samples' in params else 0
+    )
+    scores = scorer.score_all(
+        translations, 
+        references, 
+        num_workers=params['scoring_workers'] if 'scoring_workers' in params else 1
+    )
+    sentence_scores = {key: scores[key].pop("sentences") for key in scores if "sentences" in scores[key]}
     with open(Path(model_dir) / "scores.json", "w") as writer:
         json.dump(scores, writer)
+    if len(sentence_scores) > 0:
+        with open(Path(model_dir) / "sentence_scores.json", "w") as writer:
+            json.dump(sentence_scores, writer)
+    remove_checkpoint(model_dir) # the run is complete, so there is nothing left to resume
     print("Evaluation complete.")
 
 
+
+def main():
+    parser = argparse.ArgumentParser(description="Finetune NLLB model.")
+    parser.add_argument(
+        "--config", type=str, help="Directory to save finetuned model"
+    )
+    parser.add_argument(
+        "--resume", type=str, help="Model directory of an interrupted job, to continue from its checkpoint"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="Check the config's corpora and estimate the training tokens, without loading the model or tokenizer"
+    )
+    args = parser.parse_args()
+    if (args.config is None) == (args.resume is None):
+        parser.error("exactly one of --config and --resume is required")
+    if args.dry_run:
+        from dry_run import dry_run
+
+        if args.resume is not None:
+            from checkpointing import load_checkpoint
+
+            config = load_checkpoint(args.resume)[1]["config"]
+        else:
+            with open(args.config) as reader:
+                config = json.load(reader)
+        sys.exit(0 if dry_run(config) else 1)
+    from checkpointing import load_checkpoint
+    from parallel import broadcast_object, init_distributed
+
+    resume_state = None
+    if args.resume is not None:
+        model_dir = args.resume
+        _, resume_state = load_checkpoint(model_dir)
+        config = resume_state["config"]
+    else:
+        with open(args.config) as reader:
+            config = json.load(reader)
+
+    params = config["finetuning_parameters"]
+    # one process per device when launched with torchrun (see parallel.py)
+    rank, world_size = init_distributed(params['distributed_backend'] if 'distributed_backend' in params else "gloo")
+    if resume_state is not None and resume_state["world_size"] != world_size:
+        raise ValueError(f"Checkpoint was written by {resume_state['world_size']} processes, not {world_size}")
+    if resume_state is None:
+        model_dir = broadcast_object(create_model_dir(config, args.config) if rank == 0 else None)
+    run_experiment(config, model_dir, resume_state)
+
+
 if __name__ == "__main__":
     main()
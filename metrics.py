@@ -0,0 +1,94 @@
+"""
+Time and throughput measurements of the training loop.
+
+Between two reports, a PhaseTimer adds up the wall-clock time spent in each phase of training
+(reading, tokenizing and permuting batches, copying them to the device, forward and backward
+passes, optimizer steps, validation and checkpointing) and counts the real and padding tokens
+trained on. Each report is appended as one JSON object per line to ``<model_dir>/metrics.jsonl``.
+"""
+
+import contextlib
+import json
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+METRICS_FILE = "metrics.jsonl"
+
+
+class PhaseTimer:
+    def __init__(self, synchronize: Optional[Callable[[], None]] = None, sync_phases: bool = False):
+        """
+        `synchronize`, e.g. `torch.cuda.synchronize`, is called before each report, so that the
+        throughput covers all the work queued since the last one. With `sync_phases`, it is also
+        called at the end of every phase, so that asynchronous GPU work is charged to the phase
+        that launched it; this stalls the queue of GPU work, so it slows training down. Without
+        it, GPU time is charged to whichever phase next waits for the GPU.
+        """
+        self.synchronize = synchronize
+        self.sync_phases = sync_phases
+        self.reset()
+
+    def reset(self):
+        self.start_time = time.perf_counter()
+        self.seconds = defaultdict(float)
+        self.steps = 0
+        self.real_tokens = 0
+        self.pad_tokens = 0
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.sync_phases and self.synchronize is not None:
+                self.synchronize()
+            self.seconds[name] += time.perf_counter() - start
+
+    def split(self, name: str, timings: Dict[str, float]):
+        """Moves time out of phase `name` into the finer phases it was measured to consist of."""
+        for part, seconds in timings.items():
+            self.seconds[part] += seconds
+            self.seconds[name] -= seconds
+
+    def end_step(self, num_tokens: int, num_pad_tokens: int):
+        self.steps += 1
+        self.real_tokens += num_tokens - num_pad_tokens
+        self.pad_tokens += num_pad_tokens
+
+    def report(self, step: int) -> dict:
+        """Summarizes the steps since the last report, and starts a new reporting interval."""
+        if self.synchronize is not None:
+            self.synchronize()
+        elapsed = max(time.perf_counter() - self.start_time, 1e-9)
+        phases = {name: max(seconds, 0.0) for name, seconds in self.seconds.items()}
+        phases["other"] = max(elapsed - sum(phases.values()), 0.0)
+        record = {
+            "step": step,
+            "steps": self.steps,
+            "seconds": elapsed,
+            "real_tokens": self.real_tokens,
+            "pad_tokens": self.pad_tokens,
+            "tokens_per_second": (self.real_tokens + self.pad_tokens) / elapsed,
+            "real_tokens_per_second": self.real_tokens / elapsed,
+            "phase_seconds": phases,
+            "phase_percent": {name: 100 * seconds / elapsed for name, seconds in phases.items()},
+        }
+        self.reset()
+        return record
+
+
+def format_report(record: dict) -> str:
+    """One line with the throughput and the phases that took at least 1% of the time, slowest first."""
+    phases = sorted([item for item in record["phase_percent"].items() if item[1] >= 1], key=lambda item: -item[1])
+    return (
+        f"{record['real_tokens_per_second']:.0f} real tokens/s ({record['tokens_per_second']:.0f} with padding); "
+        + ", ".join(f"{name} {percent:.0f}%" for name, percent in phases)
+    )
+
+
+def append_metrics(model_dir: str, record: dict):
+    with open(Path(model_dir) / METRICS_FILE, "a") as writer:
+        writer.write(json.dumps(record) + "\n")
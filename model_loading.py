@@ -0,0 +1,167 @@
+"""
+Loads pretrained models with their weights memory-mapped from safetensors files.
+
+`from_pretrained` reads every weight into the memory of the process that loads it. When
+many finetuning runs start from the same base model, e.g. a sweep of language pairs, that
+is one full copy of the model per run. Here, the model skeleton is built without allocating
+its parameters, and each parameter is then pointed at its slice of a copy-on-write memory
+map of the safetensors file. The pages of the map belong to the OS page cache, so every
+process that maps the same file shares them, and loading is nearly instant once the file
+is cached. Parameters that will be trained are cloned into ordinary memory by
+`unshare_trainable_parameters`; frozen ones (see `freeze_encoder` and `freeze_decoder`)
+are never copied, unless the model is moved to a GPU.
+"""
+
+import contextlib
+import copy
+import json
+import mmap
+import torch
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from transformers import AutoConfig, AutoModelForSeq2SeqLM, GenerationConfig
+from transformers.utils import cached_file
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def _resolve(model_name_or_path: str, file_name: str) -> Optional[str]:
+    local = Path(model_name_or_path) / file_name
+    if local.exists():
+        return str(local)
+    if Path(model_name_or_path).is_dir():
+        return None
+    try:
+        return cached_file(model_name_or_path, file_name, _raise_exceptions_for_missing_entries=False)
+    except OSError:
+        return None
+
+
+def safetensors_files(model_name_or_path: str) -> Optional[List[str]]:
+    """The safetensors files of a local or Hugging Face Hub model, or None if it has none."""
+    index_file = _resolve(model_name_or_path, "model.safetensors.index.json")
+    if index_file is not None:
+        with open(index_file) as reader:
+            shards = sorted(set(json.load(reader)["weight_map"].values()))
+        files = [_resolve(model_name_or_path, shard) for shard in shards]
+        return files if None not in files else None
+    single_file = _resolve(model_name_or_path, "model.safetensors")
+    return [single_file] if single_file is not None else None
+
+
+def mmap_safetensors(file_path: str) -> Dict[str, torch.Tensor]:
+    """Returns the tensors of a safetensors file as views of a copy-on-write memory map of it."""
+    with open(file_path, "rb") as reader:
+        header_length = int.from_bytes(reader.read(8), "little")
+        header = json.loads(reader.read(header_length))
+        buffer = mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_COPY)  # stays valid after the file is closed
+    data_start = 8 + header_length
+    tensors = dict()
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        start, end = info["data_offsets"]
+        if end == start:
+            tensors[name] = torch.zeros(info["shape"], dtype=dtype)
+            continue
+        flat = torch.frombuffer(buffer, dtype=dtype, count=(end - start) // dtype.itemsize, offset=data_start + start)
+        tensors[name] = flat.view(info["shape"])
+    return tensors
+
+
+def load_mmapped_state_dict(model_name_or_path: str) -> Optional[Dict[str, torch.Tensor]]:
+    files = safetensors_files(model_name_or_path)
+    if files is None:
+        return None
+    state_dict = dict()
+    for file_path in files:
+        state_dict.update(mmap_safetensors(file_path))
+    return state_dict
+
+
+@contextlib.contextmanager
+def _parameters_on_meta_device():
+    """Creates module parameters (but not buffers) on the meta device, so they take no memory."""
+    register_parameter = torch.nn.Module.register_parameter
+
+    def register_meta_parameter(module, name, param):
+        if param is not None and param.device.type != "meta":
+            param = torch.nn.Parameter(param.to("meta"), requires_grad=param.requires_grad)
+        register_parameter(module, name, param)
+
+    torch.nn.Module.register_parameter = register_meta_parameter
+    try:
+        yield
+    finally:
+        torch.nn.Module.register_parameter = register_parameter
+
+
+def load_pretrained_mmapped(model_name_or_path: str, state_dict: Optional[Dict[str, torch.Tensor]] = None):
+    """
+    Like `AutoModelForSeq2SeqLM.from_pretrained`, but with memory-mapped weights. Returns None if
+    the model has no safetensors weights. `state_dict` can be a previously mapped state dict of
+    the same model, to skip reading the file headers again.
+    """
+    if state_dict is None:
+        state_dict = load_mmapped_state_dict(model_name_or_path)
+        if state_dict is None:
+            return None
+    config = AutoConfig.from_pretrained(model_name_or_path)
+    with _parameters_on_meta_device():
+        model = AutoModelForSeq2SeqLM.from_config(config)
+    model.load_state_dict(state_dict, strict=False, assign=True)  # tied weights may be missing from the file
+    model.tie_weights()
+    still_missing = [name for name, param in model.named_parameters() if param.device.type == "meta"]
+    if len(still_missing) > 0:
+        raise ValueError(f"{model_name_or_path} has no weights for: {still_missing}")
+    try:
+        model.generation_config = GenerationConfig.from_pretrained(model_name_or_path)
+    except OSError:
+        pass
+    model.eval()
+    return model
+
+
+def load_pretrained(model_name_or_path: str, cache: Optional[dict] = None) -> Tuple[torch.nn.Module, bool]:
+    """
+    Loads a pretrained model, with memory-mapped weights if it has safetensors files. Also
+    returns whether the weights are mapped (if so, call `unshare_trainable_parameters` once
+    it is known which parameters will be trained). `cache`, if given, keeps what was loaded,
+    by model name, for processes that load the same model several times.
+    """
+    if cache is not None and model_name_or_path in cache:
+        loaded = cache[model_name_or_path]
+    else:
+        loaded = load_mmapped_state_dict(model_name_or_path)
+        if loaded is None:
+            loaded = AutoModelForSeq2SeqLM.from_pretrained(model_name_or_path)
+        if cache is not None:
+            cache[model_name_or_path] = loaded
+    if isinstance(loaded, dict):
+        return load_pretrained_mmapped(model_name_or_path, loaded), True
+    return copy.deepcopy(loaded) if cache is not None else loaded, False
+
+
+def unshare_trainable_parameters(model):
+    """Gives each parameter that requires gradients its own memory, so training never writes to the map."""
+    clones = dict()  # id of a mapped parameter => its clone, so tied parameters stay tied
+    with torch.no_grad():
+        for module in model.modules():
+            for name, param in list(module._parameters.items()):
+                if param is not None and param.requires_grad:
+                    if id(param) not in clones:
+                        clones[id(param)] = torch.nn.Parameter(param.clone())
+                    module._parameters[name] = clones[id(param)]
+    return model
@@ -0,0 +1,61 @@
+"""
+Helpers for data-parallel training with torch.distributed.
+
+Launch one process per device (or CPU socket) with torchrun, e.g.
+
+    torchrun --nproc_per_node 4 finetune.py --config examples/example1.json
+
+torchrun sets the RANK, WORLD_SIZE and LOCAL_RANK environment variables. Without them, the
+helpers below describe a single process and the collectives do nothing.
+"""
+
+import os
+import torch.distributed as dist
+from typing import Any, List, Tuple
+
+
+def init_distributed(backend: str = "gloo") -> Tuple[int, int]:
+    """Joins the process group if launched by torchrun. Returns this process's rank and the world size."""
+    if int(os.environ.get("WORLD_SIZE", 1)) > 1 and not dist.is_initialized():
+        dist.init_process_group(backend=backend)
+    return get_rank(), get_world_size()
+
+
+def get_rank() -> int:
+    return dist.get_rank() if dist.is_initialized() else 0
+
+
+def get_world_size() -> int:
+    return dist.get_world_size() if dist.is_initialized() else 1
+
+
+def get_local_rank() -> int:
+    return int(os.environ.get("LOCAL_RANK", 0))
+
+
+def broadcast_object(obj: Any) -> Any:
+    """Returns rank 0's value of `obj` on every rank."""
+    if not dist.is_initialized():
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=0)
+    return objects[0]
+
+
+def gather_objects(obj: Any) -> List[Any]:
+    """Returns the values of `obj` of all ranks, in rank order, on every rank."""
+    if not dist.is_initialized():
+        return [obj]
+    objects = [None] * dist.get_world_size()
+    dist.all_gather_object(objects, obj)
+    return objects
+
+
+def barrier():
+    if dist.is_initialized():
+        dist.barrier()
+
+
+def shutdown_distributed():
+    if dist.is_initialized():
+        dist.destroy_process_group()
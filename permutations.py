@@ -1,6 +1,10 @@
 import json
+import numpy as np
 import random
-from typing import Dict
+from typing import TYPE_CHECKING, Dict
+
+if TYPE_CHECKING:
+    import torch
 
 def create_random_permutation_with_fixed_points(vocab_size, fixed_points):
     p_domain = sorted(set(range(vocab_size)) - set(fixed_points))
@@ -9,31 +13,117 @@ def create_random_permutation_with_fixed_points(vocab_size, fixed_points):
     return Permutation(p_domain, p_range)
 
 class Permutation:
+    """
+    A permutation of token ids, stored as a dense lookup table over the vocabulary.
+
+    Ids outside the table (e.g. the -100 used to mask labels) are mapped to themselves.
+    """
     def __init__(self, domain, rng):
-        self.domain = domain
-        self.range = rng
-        self.permutation = dict(zip(domain, rng))
-        self.inverse = dict(zip(rng, domain))
+        import torch  # slow to import, so only when a permutation is built
+
+        domain = torch.as_tensor(domain, dtype=torch.long)
+        rng = torch.as_tensor(rng, dtype=torch.long)
+        size = int(max(domain.max(), rng.max())) + 1 if len(domain) > 0 else 0
+        self.table = torch.arange(size)
+        self.table[domain] = rng
+        self._inverse = None
+
+    @staticmethod
+    def from_table(table):
+        import torch
+
+        permutation = Permutation([], [])
+        permutation.table = torch.as_tensor(table, dtype=torch.long)
+        return permutation
+
+    @property
+    def domain(self):
+        import torch
+
+        return torch.nonzero(self.table != torch.arange(len(self.table))).flatten().tolist()
+
+    @property
+    def range(self):
+        return self.table[self.domain].tolist()
     
     def __call__(self, i):
-        return self.permutation.get(i, i)
+        return int(self.table[i]) if 0 <= i < len(self.table) else i
+
+    def permute(self, token_ids: "torch.Tensor") -> "torch.Tensor":
+        """Applies the permutation to every id in a tensor at once."""
+        import torch
+
+        table = self.table.to(token_ids.device)
+        in_table = (token_ids >= 0) & (token_ids < len(table))
+        return torch.where(in_table, table[token_ids.clamp(0, max(len(table) - 1, 0))], token_ids)
     
     def get_inverse(self):
-        return Permutation(self.range, self.domain)
+        if self._inverse is None:
+            import torch
+
+            inverse_table = torch.empty_like(self.table)
+            inverse_table[self.table] = torch.arange(len(self.table))
+            self._inverse = Permutation.from_table(inverse_table)
+            self._inverse._inverse = self
+        return self._inverse
     
 
+PERMUTATION_MAP_MAGIC = b"PERMMAP1"
+
+
 def save_permutation_map(pmap : Dict[str, Permutation], filename : str):
-    to_serialize = dict()
+    """
+    Saves a permutation map. Files ending in ``.json`` use the original JSON format (domain and
+    range lists per key); anything else uses the compact binary format, which stores each distinct
+    permutation once as a packed int32 lookup table:
+
+        8 bytes   magic (PERMMAP1)
+        8 bytes   header length (little-endian uint64)
+        header    JSON: {"keys": {"<corpus>|||<lang>": table index}, "sizes": [table sizes]}
+        tables    int32 lookup tables, one after another
+    """
+    if str(filename).endswith(".json"):
+        to_serialize = dict()
+        for key in pmap:
+            info = {'domain': pmap[key].domain, 'range': pmap[key].range}
+            to_serialize['|||'.join(key)] = info
+        with open(filename, "w") as writer:
+            json.dump(to_serialize, writer)
+        return
+    table_indices = dict() # id(permutation) => table index
+    tables, keys = [], dict()
     for key in pmap:
-        info = {'domain': pmap[key].domain, 'range': pmap[key].range}
-        to_serialize['|||'.join(key)] = info
-    with open(filename, "w") as writer:
-        json.dump(to_serialize, writer)
+        if id(pmap[key]) not in table_indices:
+            table_indices[id(pmap[key])] = len(tables)
+            tables.append(pmap[key].table.numpy().astype(np.int32))
+        keys['|||'.join(key)] = table_indices[id(pmap[key])]
+    header = json.dumps({"keys": keys, "sizes": [len(table) for table in tables]}).encode("utf-8")
+    header += b" " * (-len(header) % 8) # keeps the tables 8-byte aligned
+    with open(filename, "wb") as writer:
+        writer.write(PERMUTATION_MAP_MAGIC)
+        writer.write(len(header).to_bytes(8, "little"))
+        writer.write(header)
+        for table in tables:
+            writer.write(table.astype("<i4").tobytes())
         
 
 def load_permutation_map(filename : str):
-    with open(filename, "r") as reader:
-        saved_drs = json.load(reader)
+    with open(filename, "rb") as reader:
+        data = reader.read()
+    if not data.startswith(PERMUTATION_MAP_MAGIC):
+        return _load_json_permutation_map(data)
+    header_length = int.from_bytes(data[8:16], "little")
+    header = json.loads(data[16 : 16 + header_length])
+    permutations, offset = [], 16 + header_length
+    for size in header["sizes"]:
+        table = np.frombuffer(data, dtype="<i4", count=size, offset=offset)
+        permutations.append(Permutation.from_table(table.astype(np.int64)))
+        offset += 4 * size
+    return {tuple(key.split("|||")): permutations[index] for key, index in header["keys"].items()}
+
+
+def _load_json_permutation_map(data: bytes):
+    saved_drs = json.loads(data)
     pmap = dict()
     for key in saved_drs:
         dr = saved_drs[key]
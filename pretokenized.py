@@ -0,0 +1,325 @@
+"""
+Pre-tokenized ("compiled") corpora.
+
+Each text file is tokenized once and stored as two flat binary arrays: the token ids of
+all lines concatenated together (``<prefix>.ids``, int32) and the offset of every line into
+that array (``<prefix>.offsets``, int64). Compiled files live under
+
+    <out_dir>/<tokenizer key>/<lang code>/<sha1 of the text file>
+
+so they are shared by every config that uses the same file, tokenizer and language code.
+At training time the arrays are memory-mapped and batches are padded straight from them,
+so the tokenizer never runs inside the training loop.
+
+To compile every corpus named in a config:
+
+    python pretokenized.py --config examples/example1.json --out_dir compiled
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+import numpy as np
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+from corpora import (
+    CorpusId,
+    MixtureOfBitexts,
+    apply_permutation,
+    batching_options,
+    lang_codes_from_config,
+    stream_lines,
+)
+from tokenization import HuggingfaceTokenizer, prepare_tokenizer
+
+if TYPE_CHECKING:
+    from transformers import BatchEncoding
+
+
+_file_digests = dict()  # (path, size, mtime) => sha1 hex digest
+
+
+def file_digest(file_path: str, chunk_size: int = 1 << 24) -> str:
+    stat = os.stat(file_path)
+    signature = (str(Path(file_path).resolve()), stat.st_size, stat.st_mtime_ns)
+    if signature not in _file_digests:
+        sha = hashlib.sha1()
+        with open(file_path, "rb") as reader:
+            for chunk in iter(lambda: reader.read(chunk_size), b""):
+                sha.update(chunk)
+        _file_digests[signature] = sha.hexdigest()
+    return _file_digests[signature]
+
+
+def tokenizer_key(tokenizer: HuggingfaceTokenizer) -> str:
+    """Identifies a tokenizer, including its max length and (possibly extended) special tokens."""
+    special_tokens = json.dumps(sorted(tokenizer.get_special_tokens().items()))
+    digest = hashlib.sha1(special_tokens.encode("utf-8")).hexdigest()[:10]
+    model_name = str(tokenizer.model_name).strip("/").replace("/", "--")
+    return f"{model_name}.max{tokenizer.max_length}.{digest}"
+
+
+class TokenizedText:
+    def __init__(self, prefix: str):
+        self.prefix = str(prefix)
+        self.offsets = TokenizedText._memmap(f"{self.prefix}.offsets", np.int64)
+        self.ids = TokenizedText._memmap(f"{self.prefix}.ids", np.int32)
+
+    @staticmethod
+    def _memmap(path: str, dtype) -> np.ndarray:
+        if os.path.getsize(path) == 0:  # np.memmap refuses empty files
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, line_num: int) -> np.ndarray:
+        return self.ids[self.offsets[line_num] : self.offsets[line_num + 1]]
+
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    @staticmethod
+    def exists(prefix: str) -> bool:
+        return os.path.exists(f"{prefix}.offsets")
+
+    @staticmethod
+    def compile(
+        text_file: str,
+        encode: Callable[[List[str]], List[List[int]]],
+        prefix: str,
+        chunk_size: int = 10000,
+    ) -> "TokenizedText":
+        """Tokenizes a text file in chunks of `chunk_size` lines and writes the arrays for `prefix`."""
+        Path(prefix).parent.mkdir(parents=True, exist_ok=True)
+        tmp_prefix = f"{prefix}.{os.getpid()}.tmp"
+        with open(f"{tmp_prefix}.ids", "wb") as id_writer, open(f"{tmp_prefix}.offsets", "wb") as offset_writer:
+            offset_writer.write(np.zeros(1, dtype=np.int64).tobytes())
+            num_ids = 0
+
+            def write_chunk(lines):
+                nonlocal num_ids
+                token_ids = encode(lines)
+                lengths = np.array([len(ids) for ids in token_ids], dtype=np.int64)
+                id_writer.write(np.fromiter((t for ids in token_ids for t in ids), dtype=np.int32).tobytes())
+                offset_writer.write((np.cumsum(lengths) + num_ids).tobytes())
+                num_ids += int(lengths.sum())
+
+            chunk = []
+            for line in stream_lines(text_file):
+                chunk.append(line)
+                if len(chunk) == chunk_size:
+                    write_chunk(chunk)
+                    chunk = []
+            if len(chunk) > 0:
+                write_chunk(chunk)
+        os.replace(f"{tmp_prefix}.ids", f"{prefix}.ids")
+        os.replace(f"{tmp_prefix}.offsets", f"{prefix}.offsets")  # written last: marks completion
+        return TokenizedText(prefix)
+
+
+def compiled_prefix(out_dir: str, tokenizer: HuggingfaceTokenizer, lang_code: str, text_file: str) -> str:
+    return str(Path(out_dir) / tokenizer_key(tokenizer) / lang_code / file_digest(text_file))
+
+
+def load_or_compile(out_dir: str, tokenizer: HuggingfaceTokenizer, lang_code: str, text_file: str) -> TokenizedText:
+    prefix = compiled_prefix(out_dir, tokenizer, lang_code, text_file)
+    if TokenizedText.exists(prefix):
+        return TokenizedText(prefix)
+    print(f"Compiling {text_file} ({lang_code}) into {prefix}")
+    return TokenizedText.compile(text_file, lambda lines: tokenizer.encode(lines, lang_code=lang_code), prefix)
+
+
+def raw_tokenizer_key(tokenizer) -> str:
+    """Like `tokenizer_key`, for a Hugging Face tokenizer called directly: untruncated, in its current `src_lang`."""
+    settings = json.dumps([
+        sorted(zip(tokenizer.all_special_tokens, tokenizer.all_special_ids)),
+        getattr(tokenizer, "src_lang", None),
+        len(tokenizer),
+    ])
+    digest = hashlib.sha1(settings.encode("utf-8")).hexdigest()[:10]
+    model_name = str(tokenizer.name_or_path).strip("/").replace("/", "--")
+    return f"{model_name}.full.{digest}"
+
+
+def load_or_tokenize(out_dir: str, tokenizer, text_file: str) -> TokenizedText:
+    """
+    The token ids of every line of a text file, as `tokenizer(line)["input_ids"]` gives them
+    for a Hugging Face `tokenizer`. The file is tokenized (in large batches) only the first time;
+    later calls memory-map the ids compiled into `out_dir`.
+    """
+    prefix = str(Path(out_dir) / raw_tokenizer_key(tokenizer) / file_digest(text_file))
+    if TokenizedText.exists(prefix):
+        return TokenizedText(prefix)
+    print(f"Tokenizing {text_file} into {prefix}")
+    return TokenizedText.compile(text_file, lambda lines: tokenizer(lines)["input_ids"], prefix)
+
+
+class PretokenizedBitext:
+    def __init__(self, lang1_text: TokenizedText, lang2_text: TokenizedText, lines: Optional[Tuple[int, int]] = None):
+        self.lang1_text = lang1_text
+        self.lang2_text = lang2_text
+        self.lines = lines
+
+    def skip(self, num_lines: int) -> "PretokenizedBitext":
+        start, end = self.lines if self.lines is not None else (0, min(len(self.lang1_text), len(self.lang2_text)))
+        return PretokenizedBitext(self.lang1_text, self.lang2_text, (start + num_lines, end))
+
+    def __iter__(self):
+        num_lines = min(len(self.lang1_text), len(self.lang2_text))
+        start, end = (0, num_lines) if self.lines is None else (self.lines[0], min(self.lines[1], num_lines))
+        for line_num in range(start, end):
+            yield self.lang1_text[line_num], self.lang2_text[line_num]
+
+
+def token_counts(token_ids: List[np.ndarray]) -> List[int]:
+    return [len(ids) for ids in token_ids]
+
+
+def collate_token_ids(batch):
+    return tuple(list(sents) for sents in zip(*batch))
+
+
+def pad_token_ids(token_ids: List[np.ndarray], pad_token_id: int) -> "BatchEncoding":
+    import torch
+    from transformers import BatchEncoding
+
+    max_length = max(len(ids) for ids in token_ids)
+    input_ids = np.full((len(token_ids), max_length), pad_token_id, dtype=np.int64)
+    attention_mask = np.zeros((len(token_ids), max_length), dtype=np.int64)
+    for row, ids in enumerate(token_ids):
+        input_ids[row, : len(ids)] = ids
+        attention_mask[row, : len(ids)] = 1
+    return BatchEncoding(
+        {"input_ids": torch.from_numpy(input_ids), "attention_mask": torch.from_numpy(attention_mask)}
+    )
+
+
+class PretokenizedMixtureOfBitexts:
+    """Drop-in replacement for TokenizedMixtureOfBitexts that reads compiled corpora."""
+
+    def __init__(
+        self,
+        mixture_of_bitexts: MixtureOfBitexts,
+        pad_token_id: int,
+        permutation_map: Dict[CorpusId, Callable[[int], int]] = dict()
+    ):
+        self.mixture_of_bitexts = mixture_of_bitexts
+        self.pad_token_id = pad_token_id
+        self.permutation_map = permutation_map
+        self.timings = dict() # seconds spent on each phase of building the last batch (see metrics.py)
+
+    def _pad(self, token_ids: List[np.ndarray], corpus: CorpusId, alt_pad_token: int = None):
+        start_time = time.perf_counter()
+        tokens = pad_token_ids(token_ids, self.pad_token_id if alt_pad_token is None else alt_pad_token)
+        permute_time = time.perf_counter()
+        if corpus in self.permutation_map:
+            apply_permutation(tokens.input_ids, self.permutation_map[corpus])
+        self.timings["pad"] += permute_time - start_time
+        self.timings["permute"] += time.perf_counter() - permute_time
+        return tokens
+
+    def next_batch(self):
+        start_time = time.perf_counter()
+        batch = self.mixture_of_bitexts.next_batch()
+        self.timings = {"read": time.perf_counter() - start_time, "pad": 0.0, "permute": 0.0}
+        if batch is None:
+            return None
+        lang1_ids, lang2_ids, lang1, lang2 = batch
+        lang1_tokenized = self._pad(lang1_ids, lang1)
+        lang2_tokenized = self._pad(lang2_ids, lang2, alt_pad_token=-100)
+        return lang1_tokenized, lang2_tokenized, lang1, lang2
+
+    def state_dict(self) -> dict:
+        return self.mixture_of_bitexts.state_dict()
+
+    def load_state_dict(self, state: dict):
+        self.mixture_of_bitexts.load_state_dict(state)
+
+    @staticmethod
+    def create_from_config(
+        config: dict,
+        split: str,
+        tokenizer: HuggingfaceTokenizer,
+        compiled_dir: str,
+        permutation_map: Dict[CorpusId, Callable[[int], int]] = dict(),
+        only_once_thru: bool = False,
+        rank: int = 0,
+        world_size: int = 1
+    ) -> "PretokenizedMixtureOfBitexts":
+        lang_codes = lang_codes_from_config(config)
+        texts = dict()
+        bitexts = dict()
+        for bitext in config['bitexts']:
+            src = (bitext['corpus'], bitext['src'])
+            tgt = (bitext['corpus'], bitext['tgt'])
+            for corpus_id in [src, tgt]:
+                if corpus_id not in texts:
+                    text_file = config['corpora'][corpus_id[0]][corpus_id[1]][split]
+                    texts[corpus_id] = load_or_compile(compiled_dir, tokenizer, lang_codes[corpus_id], text_file)
+            lines = bitext["train_lines"] if split == "train" else None
+            bitexts[(src, tgt)] = PretokenizedBitext(texts[src], texts[tgt], lines)
+        params = config["finetuning_parameters"]
+        mixture = MixtureOfBitexts(
+            bitexts,
+            params['batch_size'],
+            only_once_thru=only_once_thru,
+            collate_fn=collate_token_ids,
+            lengths_fn=token_counts,
+            rank=rank,
+            world_size=world_size,
+            **batching_options(params)
+        )
+        return PretokenizedMixtureOfBitexts(mixture, tokenizer.get_special_tokens()['<pad>'], permutation_map)
+
+    @staticmethod
+    def create_from_text(
+        config: dict,
+        split: str,
+        tokenizer: HuggingfaceTokenizer,
+        permutation_map: Dict[CorpusId, Callable[[int], int]] = dict(),
+        only_once_thru: bool = False,
+        rank: int = 0,
+        world_size: int = 1
+    ) -> "PretokenizedMixtureOfBitexts":
+        """
+        Like `create_from_config`, but tokenizes the text files as they are read (see
+        EncodedBitext), e.g. so that batches can be sized by exact token counts without
+        tokenizing every line twice.
+        """
+        lang_codes = lang_codes_from_config(config)
+        mixture = MixtureOfBitexts.create_from_config(
+            config, split, only_once_thru=only_once_thru, lengths_fn=token_counts, rank=rank, world_size=world_size,
+            collate_fn=collate_token_ids,
+            encode_fn=lambda sents, corpus: tokenizer.encode(sents, lang_code=lang_codes[corpus])
+        )
+        return PretokenizedMixtureOfBitexts(mixture, tokenizer.get_special_tokens()['<pad>'], permutation_map)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokenizes the corpora of a config once, for fast training.")
+    parser.add_argument("--config", type=str, required=True, help="Experiment config (JSON).")
+    parser.add_argument("--out_dir", type=str, default="compiled", help="Directory for the compiled corpora.")
+    parser.add_argument("--splits", type=str, nargs="+", default=["train", "dev", "test"], help="Splits to compile.")
+    parser.add_argument("--max_length", type=int, default=128, help="Maximum number of tokens per segment.")
+    args = parser.parse_args()
+
+    with open(args.config) as reader:
+        config = json.load(reader)
+    lang_codes = lang_codes_from_config(config)
+    tokenizer, _ = prepare_tokenizer(
+        config["finetuning_parameters"]["base_model"], lang_codes.values(), max_length=args.max_length
+    )
+    for (corpus, key), lang_code in lang_codes.items():
+        for split in args.splits:
+            start_time = time.time()
+            text = load_or_compile(args.out_dir, tokenizer, lang_code, config["corpora"][corpus][key][split])
+            print(f"{corpus}/{key}/{split}: {len(text)} lines, {len(text.ids)} tokens ({time.time() - start_time:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,14 @@
+import argparse
 from pathlib import Path
-from transformers import AutoTokenizer 
 import sys
 sys.path.append(str(Path(__file__).resolve().parent.parent))
-from permutations import CreateRandomPermutationWithFixedPoints
 
-model_name = "facebook/nllb-200-distilled-600M"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
 
+def batch_sort(batch_size=128, cache_dir="compiled"):
+    from transformers import AutoTokenizer
+    from permutations import create_random_permutation_with_fixed_points
+    from pretokenized import load_or_tokenize
 
-def batch_sort(batch_size=128):
     OUT_DIR = Path("./optimized_data")
     OUT_DIR.mkdir(exist_ok=True)
     num_lines = 0
@@ -22,12 +22,8 @@ def batch_sort(batch_size=128):
     base_model = "facebook/nllb-200-distilled-600M"
     tokenizer = AutoTokenizer.from_pretrained(base_model)
     tokenizer.src_lang = "eng_Latn"
-    line_length_dict = {} #Key: line number; Value: line length
-    i = 0
-    for line in line_list_en:
-        tokenized_line = tokenizer(line)['input_ids']
-        line_length_dict[i] = len(tokenized_line)
-        i+=1
+    lengths = load_or_tokenize(cache_dir, tokenizer, "europarlData/train.en").lengths()
+    line_length_dict = dict(enumerate(lengths.tolist())) #Key: line number; Value: line length
     sorted_lines = sorted(line_length_dict.items(), key=lambda item: item[1])
     order_of_lines = []
     for pair in sorted_lines:
@@ -38,7 +34,7 @@ def batch_sort(batch_size=128):
         for j in range(batch_size):
             this_batch.append(order_of_lines[i*batch_size+j])
         batch_list.append(this_batch)
-    pmap_batches = CreateRandomPermutationWithFixedPoints(number_of_batches,[]) 
+    pmap_batches = create_random_permutation_with_fixed_points(number_of_batches, [])
     reshuffled_batches = []
     for k in range(number_of_batches):
         reshuffled_batches.append(batch_list[pmap_batches(k)])
@@ -61,4 +57,12 @@ def batch_sort(batch_size=128):
         with open(OUT_DIR / f"optimized_train_{batch_size}.{lang_code}","w") as file:
             for i in range(number_of_batches):
                 for j in range(batch_size):
-                    file.write(line_list[reshuffled_batches[i][j]])
\ No newline at end of file
+                    file.write(line_list[reshuffled_batches[i][j]])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reorders europarlData/train.* into shuffled batches of similar-length lines.")
+    parser.add_argument("--batch_size", type=int, default=128, help="Desired batch size.")
+    parser.add_argument("--cache_dir", type=str, default="compiled", help="Directory for the token ids of tokenized files.")
+    args = parser.parse_args()
+    batch_sort(args.batch_size, args.cache_dir)
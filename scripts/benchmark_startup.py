@@ -0,0 +1,75 @@
+"""
+Measures how long the entry points of this repo take to start.
+
+For each module, it times a fresh interpreter importing it, and for each command, a fresh
+interpreter running it with `--help` (which should exit before any model, tokenizer or
+corpus is loaded). Each measurement is the median of several runs.
+
+    python scripts/benchmark_startup.py --repeats 5 --budget 1.0
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+MODULES = ["corpora", "permutations", "tokenization", "validate", "finetune", "pretokenized", "sweep"]
+
+COMMANDS = [
+    "finetune.py",
+    "pretokenized.py",
+    "sweep.py",
+    "scripts/batch_sort.py",
+    "scripts/extract_vocab.py",
+    "scripts/organize_into_batches.py",
+    "scripts/plot_experiment5.py",
+    "scripts/plot_scores.py",
+    "scripts/pmi.py",
+    "scripts/preprocess_europarl.py",
+    "scripts/similarity_index.py",
+]
+
+
+def time_run(args, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable] + args, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            env=dict(os.environ, PYTHONPATH=str(REPO_DIR)),
+        )
+        timings.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError(f"{' '.join(args)} failed:\n{result.stderr.decode()}")
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures import and startup times of the entry points.")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per measurement (the median is reported).")
+    parser.add_argument("--budget", type=float, default=1.0, help="Startup budget in seconds, for `--help`.")
+    args = parser.parse_args()
+
+    baseline = time_run(["-c", "pass"], args.repeats)
+    print(f"{'python -c pass':<45} {baseline:6.2f}s")
+    for module in MODULES:
+        print(f"{'import ' + module:<45} {time_run(['-c', f'import {module}'], args.repeats):6.2f}s")
+    over_budget = []
+    for command in COMMANDS:
+        elapsed = time_run([command, "--help"], args.repeats)
+        flag = "" if elapsed <= args.budget else "  OVER BUDGET"
+        if flag:
+            over_budget.append(command)
+        print(f"{command + ' --help':<45} {elapsed:6.2f}s{flag}")
+    if len(over_budget) > 0:
+        print(f"{len(over_budget)} commands over the {args.budget:.1f}s budget.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,13 @@
 
+import argparse
 from pathlib import Path
-from transformers import AutoTokenizer 
-import math
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from pretokenized import load_or_tokenize
+from pmi import LineCounts, adjacent_pair_pmi
 
-def is_directly_after(lst, elem1, elem2):
-    for i in range(len(lst) - 1):
-        if lst[i] == elem1 and lst[i + 1] == elem2:
-            return True
-    return False
 
-
-def extract_vocab(filename, lang_code1, lang_code2, filter_num, tokenizer):
+def extract_vocab(filename, lang_code1, lang_code2, filter_num, tokenizer, cache_dir="compiled"):
     OUT_DIR = Path(f"../pmi_lang_pairs_data/{filter_num}filtered")
     OUT_DIR.mkdir(exist_ok=True)
     
@@ -48,63 +45,25 @@ def extract_vocab(filename, lang_code1, lang_code2, filter_num, tokenizer):
             k = 1
             i += 1
     print(candidates)
-    line_list1 = []
-    line_list2 = []
-
     filename1 = f"/mnt/storage/sotnichenko/encoder-decoder-finetuning/europarlData/dev.{lang_code1}"
     filename2 = f"/mnt/storage/sotnichenko/encoder-decoder-finetuning/europarlData/dev.{lang_code2}"
-    with open(filename1, "r") as f1:
-        line_list1 = f1.readlines()
-
-    with open(filename2, "r") as f2:
-        line_list2 = f2.readlines()
+    text1 = load_or_tokenize(cache_dir, tokenizer, filename1)
+    text2 = load_or_tokenize(cache_dir, tokenizer, filename2)
+    num_lines = len(text1)
 
+    vocab_size = max(len(tokenizer), int(text1.ids.max(initial=-1)) + 1, int(text2.ids.max(initial=-1)) + 1)
+    counts1 = LineCounts.for_text(text1, vocab_size)
+    counts2 = LineCounts.for_text(text2, vocab_size, num_lines)
     print("Read files")
+    candidate_pairs = list(dict.fromkeys(
+        (tokenizer.convert_tokens_to_ids(token1), tokenizer.convert_tokens_to_ids(token2)) for token1, token2 in candidates
+    ))
     candidate_analysis = {} #Key: (token1,token2); Value: (pmi_pair_lang1, pmi_pair_lang2)
-    lang1_token_counter = {} #Key: (token1,token2); Value: (token1_count_lang1, token2_count_lang1, both_tokens)
-    lang2_token_counter = {} #Key: (token1,token2); Value: (token1_count_lang2, token2_count_lang2, both_tokens)
-    for i in range(len(line_list1)):
-        print(i)
-        tokenized1 = tokenizer(line_list1[i])
-        tokenized2 = tokenizer(line_list2[i])
-        for candidate_pair in candidates:
-            token1 = tokenizer.convert_tokens_to_ids(candidate_pair[0])
-            token2 = tokenizer.convert_tokens_to_ids(candidate_pair[1])
-            if (token1,token2) not in lang1_token_counter.keys():
-                lang1_token_counter[(token1,token2)] = [0,0,0]
-                lang2_token_counter[(token1,token2)] = [0,0,0]
-            
-            if token1 in tokenized1['input_ids']:
-                lang1_token_counter[(token1,token2)][0] += 1
-                if token2 in tokenized1['input_ids'] and is_directly_after(tokenized1['input_ids'], token1, token2):
-                    print("HIII")
-                    lang1_token_counter[(token1,token2)][1] += 1
-                    lang1_token_counter[(token1,token2)][2] += 1
-            elif token2 in tokenized1['input_ids']:
-                lang1_token_counter[(token1,token2)][1] += 1
-            
-            if token1 in tokenized2['input_ids']:
-                lang2_token_counter[(token1,token2)][0] += 1
-                if token2 in tokenized2['input_ids'] and is_directly_after(tokenized2['input_ids'], token1, token2):
-                    lang2_token_counter[(token1,token2)][1] += 1
-                    lang2_token_counter[(token1,token2)][2] += 1
-            elif token2 in tokenized2['input_ids']:
-                lang2_token_counter[(token1,token2)][1] += 1
-
-            if i == len(line_list1) - 1:
-                        token1_count_lang1 = lang1_token_counter[(token1,token2)][0]
-                        token2_count_lang1 = lang1_token_counter[(token1,token2)][1]
-                        both_tokens_lang1 = lang1_token_counter[(token1,token2)][2]
-                        r1 = (both_tokens_lang1*len(line_list1))/(token1_count_lang1*token2_count_lang1) if (token1_count_lang1 != 0 and token2_count_lang1 !=0) else 0
-                        candidate_pair_pmi_lang1 = math.log2(r1) if r1 > 0 else 0
-                        candidate_analysis[(token1,token2)] = [candidate_pair_pmi_lang1,0]
-
-                        token1_count_lang2 = lang2_token_counter[(token1,token2)][0]
-                        token2_count_lang2 = lang2_token_counter[(token1,token2)][1]
-                        both_tokens_lang2 = lang2_token_counter[(token1,token2)][2]
-                        r2 = (both_tokens_lang2*len(line_list1))/(token1_count_lang2*token2_count_lang2) if (token1_count_lang2 != 0 and token2_count_lang2 !=0) else 0
-                        candidate_pair_pmi_lang2 = math.log2(r2) if r2 > 0 else 0
-                        candidate_analysis[(token1,token2)][1] += candidate_pair_pmi_lang2
+    if num_lines > 0:
+        pmis1 = adjacent_pair_pmi(counts1, candidate_pairs)
+        pmis2 = adjacent_pair_pmi(counts2, candidate_pairs)
+        for candidate_pair, pmi1, pmi2 in zip(candidate_pairs, pmis1, pmis2):
+            candidate_analysis[candidate_pair] = [pmi1, pmi2]
     print(candidate_analysis)
     finalists = []
     print(finalists)
@@ -115,7 +74,18 @@ def extract_vocab(filename, lang_code1, lang_code2, filter_num, tokenizer):
 
     return finalists
 
-model_name = "facebook/nllb-200-distilled-600M"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
 
-print(extract_vocab("es_en_pmi_ranking.txt", "es", "en", 10, tokenizer))
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Finds candidate multi-token vocabulary items from a PMI ranking.")
+    parser.add_argument("--ranking", type=str, default="es_en_pmi_ranking.txt", help="PMI ranking file.")
+    parser.add_argument("--lang1", type=str, default="es", help="First language code.")
+    parser.add_argument("--lang2", type=str, default="en", help="Second language code.")
+    parser.add_argument("--filter_num", type=int, default=10, help="Filter the ranking was computed with.")
+    parser.add_argument("--model", type=str, default="facebook/nllb-200-distilled-600M", help="Tokenizer to use.")
+    parser.add_argument("--cache_dir", type=str, default="compiled", help="Directory for the token ids of tokenized files.")
+    args = parser.parse_args()
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    print(extract_vocab(args.ranking, args.lang1, args.lang2, args.filter_num, tokenizer, args.cache_dir))
+
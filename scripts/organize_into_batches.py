@@ -1,19 +1,44 @@
 import argparse
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from random import shuffle
-from tqdm import tqdm
-from transformers import AutoTokenizer
 
+import numpy as np
 
-def reorganize(batch_size, root_dir, split, output_dir):
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from corpora import LineIndex
+
+
+def write_reordered(in_file, out_file, line_nums, block_size=100000):
+    """
+    Writes line `line_nums[k]` of `in_file` (stripped) as line k of `out_file`. Lines are read by
+    seeking to their byte offsets, `block_size` output lines at a time, so memory stays bounded.
+    """
+    offsets = LineIndex.for_file(in_file).offsets
+    line_nums = np.asarray(line_nums, dtype=np.int64)
+    with open(in_file, "rb") as reader, open(out_file, "w") as writer:
+        for start in range(0, len(line_nums), block_size):
+            block = line_nums[start : start + block_size]
+            lines = [None] * len(block)
+            for k in np.argsort(block, kind="stable").tolist():  # in file order, to seek forward
+                reader.seek(offsets[block[k]])
+                lines[k] = reader.read(offsets[block[k] + 1] - offsets[block[k]]).decode("utf-8").strip()
+            writer.write("".join(line + "\n" for line in lines))
+    return out_file
+
+
+def reorganize(batch_size, root_dir, split, output_dir, cache_dir="compiled", num_workers=4):
     """
     Reorganizes text files by sorting lines by token length and shuffling in batches.
 
-    This function tokenizes each line of the English split file using a pretrained tokenizer,
+    This function tokenizes each line of the English split file using a pretrained tokenizer (or
+    reads the token ids from `cache_dir`, if the file was tokenized before),
     sorts all lines by their tokenized length, chunks them into batches, shuffles the batch
-    order, and then reorders all split-related files accordingly. The reorganized files are
-    saved to `output_dir`.
+    order, and then reorders all split-related files accordingly, `num_workers` files at a time.
+    The reorganized files are saved to `output_dir`.
 
     Parameters
     ----------
@@ -25,40 +50,45 @@ def reorganize(batch_size, root_dir, split, output_dir):
         Prefix of the files to process (e.g., "train" for "train.en", "train.fr", etc.).
     output_dir : Path
         Path to the directory where reorganized files will be written. Must not exist prior to call.
+    cache_dir : str
+        Directory where the token ids of the English file are kept, so that it is only tokenized once.
+    num_workers : int
+        Number of files reordered in parallel (each by its own process).
 
     Raises
     ------
     FileExistsError
         If `output_dir` already exists.
     """
-    
+    from tqdm import tqdm
+    from transformers import AutoTokenizer
+    from pretokenized import load_or_tokenize
+
     os.mkdir(output_dir)
-    files = list(root_dir.glob(f"{split}.*"))
+    files = [file for file in root_dir.glob(f"{split}.*") if LineIndex.SUFFIX not in file.name]
     model_name = "facebook/nllb-200-distilled-600M"
     tokenizer = AutoTokenizer.from_pretrained(model_name)
-    lengths = []
-    with open(root_dir / f"{split}.en") as reader:
-        for i, line in tqdm(enumerate(reader)):
-            line = line.strip()
-            tokens = tokenizer(line)["input_ids"]
-            lengths.append((len(tokens), i))
-    line_nums_by_length = [line_num for _, line_num in sorted(lengths)]
+    start_time = time.time()
+    token_counts = load_or_tokenize(cache_dir, tokenizer, str(root_dir / f"{split}.en")).lengths()
+    print(f"Token counts of {len(token_counts)} lines of {split}.en: {time.time() - start_time:.1f}s")
+
+    start_time = time.time()
+    line_nums_by_length = np.argsort(token_counts, kind="stable") # by length, then line number
     chunk_starts = [
         batch_size * k for k in range((len(line_nums_by_length) // batch_size) - 1)
     ]
     shuffle(chunk_starts)
-    line_nums = []
-    for start in chunk_starts:
-        line_nums.extend(line_nums_by_length[start : start + batch_size])
+    line_nums = np.concatenate(
+        [line_nums_by_length[start : start + batch_size] for start in chunk_starts] + [np.zeros(0, dtype=np.int64)]
+    )
+    print(f"Permutation of {len(line_nums)} lines: {time.time() - start_time:.1f}s")
 
-    for file in files:
-        lines = []
-        with open(file) as reader:
-            for line in tqdm(reader):
-                lines.append(line.strip())
-        with open(output_dir / file.name, "w") as writer:
-            for num in tqdm(line_nums):
-                writer.write(lines[num] + "\n")
+    start_time = time.time()
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        futures = [pool.submit(write_reordered, str(file), str(output_dir / file.name), line_nums) for file in files]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            future.result()
+    print(f"Reordered {len(files)} files with {num_workers} workers: {time.time() - start_time:.1f}s")
 
 
 if __name__ == "__main__":
@@ -66,7 +96,9 @@ if __name__ == "__main__":
     parser.add_argument("--in_dir", type=str, required=True, help="Directory with the original files.")
     parser.add_argument("--out_dir", type=str, required=True, help="Directory for storing the new, reordered files.")
     parser.add_argument("--batch_size", type=int, default=128, help="Desired batch size.")
+    parser.add_argument("--cache_dir", type=str, default="compiled", help="Directory for the token ids of tokenized files.")
+    parser.add_argument("--num_workers", "--num-workers", type=int, default=4, help="Number of files reordered in parallel.")
     args = parser.parse_args()
     in_dir = Path(args.in_dir)        
     out_dir = Path(args.out_dir)  
-    reorganize(args.batch_size, in_dir, "train", out_dir)
+    reorganize(args.batch_size, in_dir, "train", out_dir, args.cache_dir, args.num_workers)
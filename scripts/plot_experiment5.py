@@ -1,7 +1,11 @@
+import argparse
 import json
-import matplotlib.pyplot as plt
 from pathlib import Path
-import sys
+
+parser = argparse.ArgumentParser(description="Plots the multitune gain of each language pair against its divergence.")
+parser.add_argument("experiment", type=str, nargs="?", default="exp5", help="Experiment prefix (a subdirectory of experiments/).")
+parser.add_argument("metric", type=str, nargs="?", default="chrf", help="Score to plot.")
+args = parser.parse_args()
 
 divergences = {('bg', 'cs'): 5.779367890498415, 
                ('bg', 'da'): 5.765412668008769, 
@@ -21,7 +25,7 @@ divergences = {('bg', 'cs'): 5.779367890498415,
 
 
 BASE_DIR = Path("experiments/") 
-METRIC = "chrf" if len(sys.argv) <= 2 else sys.argv[2]
+METRIC = args.metric
 
 def mean(ls):
     return sum(ls) / len(ls)
@@ -34,7 +38,7 @@ def read_scores(experiment_dir):
         data = None
     return data
 
-PREFIX = "exp5"
+PREFIX = args.experiment
 top_dirs = list(BASE_DIR.glob(f"{PREFIX}-*")) 
 
 xs = []
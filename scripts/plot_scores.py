@@ -1,15 +1,15 @@
+import argparse
 import json
-import matplotlib.pyplot as plt
 from pathlib import Path
-import sys
 
-if len(sys.argv) <= 1:
-    print("Usage: python plot_scores.py EXPERIMENT METRIC")
-    exit()
-    
-PREFIX = sys.argv[1]
+parser = argparse.ArgumentParser(description="Plots the mean test score of bitune and multitune runs by training size.")
+parser.add_argument("experiment", type=str, help="Experiment prefix (a subdirectory of experiments/).")
+parser.add_argument("metric", type=str, nargs="?", default="chrf", help="Score to plot.")
+args = parser.parse_args()
+
+PREFIX = args.experiment
 BASE_DIR = Path("experiments/") / PREFIX
-METRIC = "chrf" if len(sys.argv) <= 2 else sys.argv[2]
+METRIC = args.metric
 
 def mean(ls):
     return sum(ls) / len(ls)
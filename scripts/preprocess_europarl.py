@@ -14,25 +14,25 @@ etc.
 - The files will have the same number of lines.
 - Line k of each file corresponds to meaning of line k in english.txt.
 - There are no duplicate lines in english.txt.
+
+The raw files are never held in memory together. Each language pair is read by its own
+worker process, which reduces every English sentence to a 64-bit hash and keeps, per hash,
+the line numbers of its first and last occurrence. The sentences that occur in every
+language are found by intersecting these arrays, and each output file is then written by
+a worker that reads back only the lines it needs from one raw file. The output is the same
+as that of keeping every translation in one table (barring a 64-bit hash collision).
 """
 
 import argparse
-from collections import defaultdict
-from pathlib import Path
+import hashlib
 import random
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
 
-parser = argparse.ArgumentParser(description="Preprocessing script for raw Europarl files.")
-parser.add_argument("--data_dir", type=str, required=True, help="Directory with raw Europarl files.")
-parser.add_argument("--out_dir", type=str, required=True, help="Directory for storing the preprocessed data.")
-parser.add_argument("--min_length", type=int, default=10, help="Minimum length of (English) sentences to keep.")
-parser.add_argument("--seed", type=int, default=42, help="Random seed (for shuffling).")
-parser.add_argument("--num_dev", type=int, default=5000, help="Number of sentences to reserve for the dev set.")
-parser.add_argument("--num_test", type=int, default=5000, help="Number of sentences to reserve for the test set.")
-args = parser.parse_args()
-data_dir = Path(args.data_dir)        
-out_dir = Path(args.out_dir)  
-out_dir.mkdir(exist_ok=True)
-language_codes = {
+import numpy as np
+
+LANGUAGE_CODES = {
     "bg": "bulgarian",
     "cs": "czech",
     "da": "danish",
@@ -55,61 +55,130 @@ language_codes = {
     "sv": "swedish",
 }
 
-# Enumerate the raw Europarl files in the data directory.
-pairs      = []       # (english_path, lang_path, code)
-found_lang = []
-for code in language_codes:
-    en_file  = data_dir / f"europarl-v7.{code}-en.en"
-    xx_file  = data_dir / f"europarl-v7.{code}-en.{code}"
-    if en_file.exists() and xx_file.exists():
-        pairs.append((en_file, xx_file, code))
-        found_lang.append(code)
-    else:
-        print(f"Missing files for {code}: skipped")
-print(f"Found {len(found_lang)} languages: {', '.join(found_lang)}.")
-print("The data is being processed, please wait.")
-
-# Build a dictionary to store the raw data. 
-# Key: en sentence 
-# Value: dictionary of translations into other languages 
-  # Key: language code xx
-  # Value: translation into xx language
-table = defaultdict(dict) # using dict allows to eliminate duplicates
-for en_path, xx_path, code in pairs:
+
+def sentence_hash(sentence: str) -> int:
+    return int.from_bytes(hashlib.blake2b(sentence.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def index_pair(en_path: Path, xx_path: Path, min_length: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Hashes the English sentences (of at least `min_length` characters) of a language pair.
+    Returns the distinct hashes, sorted, and the line numbers of their first and last occurrence.
+    """
+    hashes, line_nums = [], []
     with en_path.open(encoding="utf-8") as f_en, xx_path.open(encoding="utf-8") as f_xx:
-        for en_line, xx_line in zip(f_en, f_xx):
-            en = en_line.rstrip() # the english of xx language
-            xx = xx_line.rstrip() # the translation into xx language
-            table[en][code] = xx
-
-
-# Only keep the sentences that appear in every single language
-# and which have a character length greater than (or equal to) args.min_length.  
-keep_en = [s for s, d in table.items() if len(d) == len(found_lang) and len(s) >= args.min_length] 
-
-# Randomly shuffle the data.
-r = random.Random(args.seed)
-r.shuffle(keep_en)
-
-# Write the parallel corpora to disk.
-train_output = { "en": (out_dir / "train.en").open("w", encoding="utf-8", newline="\n") }
-dev_output = { "en": (out_dir / "dev.en").open("w", encoding="utf-8", newline="\n") }
-test_output = { "en": (out_dir / "test.en").open("w", encoding="utf-8", newline="\n") }
-for code in found_lang:
-    train_output[code] = (out_dir / f"train.{code}").open("w", encoding="utf-8", newline="\n")
-    dev_output[code] = (out_dir / f"dev.{code}").open("w", encoding="utf-8", newline="\n")
-    test_output[code] = (out_dir / f"test.{code}").open("w", encoding="utf-8", newline="\n")
-for i, en in enumerate(keep_en):
-    if i < args.num_dev:
-        output = dev_output
-    elif i < args.num_dev + args.num_test:
-        output = test_output
-    else:
-        output = train_output
-    output["en"].write(en + "\n") # write english file
-    for code in found_lang:
-        output[code].write(table[en][code] + "\n") # write each xx language file
-for file in output.values():
-    file.close()
+        for line_num, (en_line, _) in enumerate(zip(f_en, f_xx)):
+            en = en_line.rstrip()
+            if len(en) >= min_length:
+                hashes.append(sentence_hash(en))
+                line_nums.append(line_num)
+    hashes = np.array(hashes, dtype=np.uint64)
+    line_nums = np.array(line_nums, dtype=np.int64)
+    unique_hashes, first = np.unique(hashes, return_index=True)
+    _, last_reversed = np.unique(hashes[::-1], return_index=True)
+    return unique_hashes, line_nums[first], line_nums[len(hashes) - 1 - last_reversed]
+
+
+def write_splits(in_path: Path, line_nums: np.ndarray, out_paths: List[Path], split_sizes: List[int]):
+    """
+    Writes line `line_nums[k]` of a raw file (without trailing whitespace) as line k of the
+    concatenation of `out_paths`, the first of which gets `split_sizes[0]` lines, and so on.
+    """
+    order = np.argsort(line_nums)
+    wanted = line_nums[order].tolist()
+    positions = order.tolist()
+    lines = [None] * len(wanted)
+    k = 0
+    with in_path.open(encoding="utf-8") as reader:
+        for line_num, line in enumerate(reader):
+            if k == len(wanted):
+                break
+            if line_num == wanted[k]:
+                lines[positions[k]] = line.rstrip()
+                k += 1
+    start = 0
+    for out_path, size in zip(out_paths, split_sizes):
+        with out_path.open("w", encoding="utf-8", newline="\n") as writer:
+            for line in lines[start : start + size]:
+                writer.write(line + "\n")
+        start += size
+
+
+def preprocess(
+    data_dir: Path, out_dir: Path, min_length: int, seed: int, num_dev: int, num_test: int, num_workers: int
+):
+    # Enumerate the raw Europarl files in the data directory.
+    pairs      = []       # (english_path, lang_path, code)
+    found_lang = []
+    for code in LANGUAGE_CODES:
+        en_file  = data_dir / f"europarl-v7.{code}-en.en"
+        xx_file  = data_dir / f"europarl-v7.{code}-en.{code}"
+        if en_file.exists() and xx_file.exists():
+            pairs.append((en_file, xx_file, code))
+            found_lang.append(code)
+        else:
+            print(f"Missing files for {code}: skipped")
+    print(f"Found {len(found_lang)} languages: {', '.join(found_lang)}.")
+    print("The data is being processed, please wait.")
+
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        indices: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = dict(zip(
+            found_lang, pool.map(index_pair, *zip(*[(en, xx, min_length) for en, xx, _ in pairs]))
+        ))
+
+        # Only keep the sentences that appear in every single language
+        # and which have a character length greater than (or equal to) min_length,
+        # in the order in which they first appear (in the first language pair).
+        keep = np.zeros(0, dtype=np.uint64)
+        if len(found_lang) > 0:
+            first_hashes, first_lines, _ = indices[found_lang[0]]
+            keep = first_hashes[np.argsort(first_lines, kind="stable")]
+            for code in found_lang[1:]:
+                keep = keep[np.isin(keep, indices[code][0])]
+
+        # Randomly shuffle the data.
+        order = list(range(len(keep)))
+        random.Random(seed).shuffle(order)
+        keep = keep[np.array(order, dtype=np.int64)]
+
+        # Write the parallel corpora to disk: English from the first language pair,
+        # each xx language from the last occurrence of the English sentence in its own pair.
+        num_dev = min(num_dev, len(keep))
+        num_test = min(num_test, len(keep) - num_dev)
+        split_sizes = [num_dev, num_test, len(keep) - num_dev - num_test]
+        jobs = []
+        for (en_path, xx_path, code) in pairs:
+            hashes, first_lines, last_lines = indices[code]
+            if code == found_lang[0]:
+                jobs.append((en_path, first_lines[np.searchsorted(hashes, keep)], "en"))
+            jobs.append((xx_path, last_lines[np.searchsorted(hashes, keep)], code))
+        if len(found_lang) == 0:
+            for split in ["dev", "test", "train"]:
+                (out_dir / f"{split}.en").open("w").close()
+        futures = [
+            pool.submit(
+                write_splits, in_path, line_nums, [out_dir / f"{split}.{code}" for split in ["dev", "test", "train"]], split_sizes
+            )
+            for in_path, line_nums, code in jobs
+        ]
+        for future in futures:
+            future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preprocessing script for raw Europarl files.")
+    parser.add_argument("--data_dir", type=str, required=True, help="Directory with raw Europarl files.")
+    parser.add_argument("--out_dir", type=str, required=True, help="Directory for storing the preprocessed data.")
+    parser.add_argument("--min_length", type=int, default=10, help="Minimum length of (English) sentences to keep.")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed (for shuffling).")
+    parser.add_argument("--num_dev", type=int, default=5000, help="Number of sentences to reserve for the dev set.")
+    parser.add_argument("--num_test", type=int, default=5000, help="Number of sentences to reserve for the test set.")
+    parser.add_argument("--num_workers", type=int, default=4, help="Number of language pairs read (or files written) at once.")
+    args = parser.parse_args()
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(exist_ok=True)
+    preprocess(Path(args.data_dir), out_dir, args.min_length, args.seed, args.num_dev, args.num_test, args.num_workers)
 
 
+if __name__ == "__main__":
+    main()
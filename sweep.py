@@ -0,0 +1,139 @@
+"""
+Runs every experiment config in a directory, several at a time.
+
+    python sweep.py --configs configs/exp1-8 --workers 2 --devices 0 1
+
+Each worker is a long-lived process pinned to one device (a GPU, or the CPU if no devices
+are given). Workers keep the tokenizers and pretrained base models they have loaded, so
+configs that share them do not load them again. A config is skipped if one of its model
+directories (``<model_dir>-v<n>``) already has ``scores.json``; if one has a resumable
+checkpoint instead, the run is resumed from it. The output of each run goes to
+``<log_dir>/<config name>.log``.
+"""
+
+import argparse
+import contextlib
+import glob
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import List, Optional
+
+
+def model_dirs(config: dict) -> List[str]:
+    """The existing versioned model directories of a config, oldest first."""
+    pattern = glob.escape(config["model_dir"]) + "-v*"
+    dirs = [d for d in glob.glob(pattern) if d[len(config["model_dir"]) + 2 :].isdigit()]
+    return sorted(dirs, key=lambda d: int(d[len(config["model_dir"]) + 2 :]))
+
+
+def is_complete(config: dict) -> bool:
+    return any((Path(d) / "scores.json").exists() for d in model_dirs(config))
+
+
+def resumable_model_dir(config: dict) -> Optional[str]:
+    from checkpointing import has_checkpoint
+
+    resumable = [d for d in model_dirs(config) if has_checkpoint(d)]
+    return resumable[-1] if len(resumable) > 0 else None
+
+
+_tokenizers = dict()
+_base_models = dict()
+
+
+def _init_worker(devices):
+    device = devices.get()
+    if device is not None:  # must happen before CUDA is initialized in this process
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(device)
+    else:
+        os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+
+def _run_config(config_path: str, log_dir: str) -> dict:
+    from checkpointing import load_checkpoint
+    from finetune import create_model_dir, run_experiment
+
+    with open(config_path) as reader:
+        config = json.load(reader)
+    start_time = time.time()
+    log_file = Path(log_dir) / f"{Path(config_path).stem}.log"
+    with open(log_file, "a") as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        model_dir = resumable_model_dir(config)
+        if model_dir is not None:
+            print(f"Resuming {model_dir}")
+            _, resume_state = load_checkpoint(model_dir)
+        else:
+            model_dir, resume_state = create_model_dir(config, config_path), None
+        run_experiment(config, model_dir, resume_state, tokenizers=_tokenizers, base_models=_base_models)
+    with open(Path(model_dir) / "scores.json") as reader:
+        scores = json.load(reader)
+    return {"model_dir": model_dir, "scores": scores, "seconds": time.time() - start_time}
+
+
+def _run_config_safely(config_path: str, log_dir: str) -> dict:
+    try:
+        return _run_config(config_path, log_dir)
+    except Exception:
+        return {"error": traceback.format_exc()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a directory of experiment configs on a pool of workers.")
+    parser.add_argument("--configs", type=str, required=True, help="Directory of experiment configs (JSON).")
+    parser.add_argument("--workers", type=int, default=1, help="Number of experiments run at a time.")
+    parser.add_argument(
+        "--devices", type=int, nargs="*", default=None,
+        help="GPUs to run on, assigned to workers round-robin (default: the CPU).",
+    )
+    parser.add_argument("--log_dir", type=str, default="logs", help="Directory for the output of each run.")
+    args = parser.parse_args()
+
+    config_paths = sorted(glob.glob(os.path.join(args.configs, "*.json")))
+    pending = []
+    for config_path in config_paths:
+        with open(config_path) as reader:
+            config = json.load(reader)
+        if is_complete(config):
+            print(f"Skipping {config_path}: already has scores.json")
+        else:
+            pending.append(config_path)
+    print(f"{len(pending)} of {len(config_paths)} configs to run, on {args.workers} workers.")
+    if len(pending) == 0:
+        return
+    os.makedirs(args.log_dir, exist_ok=True)
+
+    context = multiprocessing.get_context("spawn")  # fresh processes, so each can pick its own GPU
+    devices = context.Manager().Queue()
+    for worker in range(args.workers):
+        devices.put(args.devices[worker % len(args.devices)] if args.devices else None)
+    start_time = time.time()
+    failures = []
+    with ProcessPoolExecutor(
+        max_workers=args.workers, mp_context=context, initializer=_init_worker, initargs=(devices,)
+    ) as executor:
+        futures = {executor.submit(_run_config_safely, path, args.log_dir): path for path in pending}
+        for num_done, future in enumerate(as_completed(futures), start=1):
+            config_path, result = futures[future], future.result()
+            elapsed = time.time() - start_time
+            remaining = elapsed / num_done * (len(pending) - num_done)
+            if "error" in result:
+                failures.append(config_path)
+                print(f"[{num_done}/{len(pending)}] FAILED {config_path}\n{result['error']}")
+            else:
+                print(
+                    f"[{num_done}/{len(pending)}] {config_path} -> {result['model_dir']} "
+                    f"({result['seconds'] / 60:.1f} min): {json.dumps(result['scores'])}"
+                )
+            print(f"  elapsed {elapsed / 60:.1f} min, about {remaining / 60:.1f} min to go")
+    print(f"Sweep complete: {len(pending) - len(failures)} succeeded, {len(failures)} failed.")
+    for config_path in failures:
+        print(f"  failed: {config_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import threading
+import unittest
+import torch
+from transformers import M2M100Config, M2M100ForConditionalGeneration
+from checkpointing import (
+    CheckpointWriter,
+    has_checkpoint,
+    load_checkpoint,
+    remove_checkpoint,
+    save_checkpoint,
+    save_model,
+)
+
+
+def tiny_model():
+    config = M2M100Config(
+        vocab_size=64, d_model=16, encoder_layers=1, decoder_layers=1,
+        encoder_attention_heads=2, decoder_attention_heads=2,
+        encoder_ffn_dim=32, decoder_ffn_dim=32, max_position_embeddings=32,
+    )
+    return M2M100ForConditionalGeneration(config)
+
+
+class TestCheckpointing(unittest.TestCase):
+    def test_superseded_saves_are_skipped(self):
+        started, release = threading.Event(), threading.Event()
+        written = []
+        writer = CheckpointWriter()
+        writer.save("a", lambda: (started.set(), release.wait(), written.append("a1")))
+        started.wait()
+        writer.save("b", lambda: written.append("b1"))
+        writer.save("b", lambda: written.append("b2"))
+        writer.save("a", lambda: written.append("a2"))
+        release.set()
+        writer.close()
+        self.assertEqual(written, ["a1", "b2", "a2"])
+
+    def test_write_errors_are_reraised(self):
+        def fail():
+            raise OSError("disk full")
+
+        writer = CheckpointWriter()
+        writer.save("a", fail)
+        with self.assertRaises(OSError):
+            writer.wait()
+        writer.close()
+
+    def test_background_saves_snapshot_the_weights(self):
+        model = tiny_model()
+        expected = {name: tensor.clone() for name, tensor in model.state_dict().items()}
+        with tempfile.TemporaryDirectory() as model_dir:
+            writer = CheckpointWriter()
+            save_model(model, model_dir, writer=writer)
+            save_checkpoint(model_dir, model, {"step": 3, "weight": model.lm_head.weight}, writer=writer)
+            with torch.no_grad():
+                for param in model.parameters():
+                    param.add_(1.0)
+            writer.close()
+            for path in [model_dir, str(load_checkpoint(model_dir)[0])]:
+                saved = M2M100ForConditionalGeneration.from_pretrained(path).state_dict()
+                for name, tensor in expected.items():
+                    self.assertTrue(torch.equal(saved[name], tensor), name)
+            training_state = load_checkpoint(model_dir)[1]
+            self.assertEqual(training_state["step"], 3)
+            self.assertTrue(torch.equal(training_state["weight"], expected["lm_head.weight"]))
+
+    def test_removed_checkpoints_leave_the_model(self):
+        model = tiny_model()
+        with tempfile.TemporaryDirectory() as model_dir:
+            save_model(model, model_dir)
+            save_checkpoint(model_dir, model, {"step": 3})
+            os.makedirs(os.path.join(model_dir, "checkpoint.tmp")) # an interrupted save
+            self.assertTrue(has_checkpoint(model_dir))
+            remove_checkpoint(model_dir)
+            self.assertFalse(has_checkpoint(model_dir))
+            self.assertEqual(sorted(os.listdir(model_dir)), sorted(["config.json", "generation_config.json", "model.safetensors"]))
+            M2M100ForConditionalGeneration.from_pretrained(model_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,20 @@
 import json
+import os
+import tempfile
 import unittest
-from corpora import Bitext, MultifileBitext, MixtureOfBitexts, TokenizedMixtureOfBitexts
+from corpora import (
+    Bitext,
+    EncodedBitext,
+    LineIndex,
+    Shard,
+    MultifileBitext,
+    MixtureOfBitexts,
+    PrefetchingBatchProducer,
+    TokenizedMixtureOfBitexts,
+    materialize_batches,
+    stream_lines,
+    word_counts,
+)
 from torch import tensor
 from tokenization import NllbTokenizer
 
@@ -266,6 +280,229 @@ class TestUtil(unittest.TestCase):
         )
         self.assertIn(batch, [expected1, expected2])
 
+    def test_limited_lines_match_full_scan(self):
+        with open("test_files/lang1.txt", encoding="utf-8") as reader:
+            all_lines = [line.rstrip("\n") for line in reader]
+        for start, end in [(0, 3), (4, 7), (17, 20), (18, 25), (30, 40)]:
+            bitext = Bitext("test_files/lang1.txt", "test_files/lang2.txt", lines=[start, end])
+            result = [src for src, _ in bitext]
+            self.assertEqual(result, all_lines[start:end])
+
+    def test_line_index_rebuilt_when_file_changes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "lines.txt")
+            with open(path, "w", encoding="utf-8") as writer:
+                writer.write("zero\nun\ndos\n")
+            self.assertEqual(len(LineIndex.for_file(path)), 3)
+            self.assertTrue(os.path.exists(path + LineIndex.SUFFIX))
+            with open(path, "w", encoding="utf-8") as writer:
+                writer.write("zero\nun\ndos\ntrois\nquatre")
+            index = LineIndex.for_file(path)
+            self.assertEqual(len(index), 5)
+            self.assertEqual(index.offset(4), len("zero\nun\ndos\ntrois\n"))
+            bitext = Bitext(path, path, lines=[3, 5])
+            self.assertEqual(list(bitext), [("trois", "trois"), ("quatre", "quatre")])
+
+    def test_prefetching_preserves_batch_order(self):
+        text_files = {
+            "lang1": "test_files/lang1.txt",
+            "lang2": "test_files/lang2.txt",
+            "lang3": "test_files/lang3.txt",
+        }
+        lps = [("lang1", "lang2", None), ("lang1", "lang3", [5, 20])]
+        mix = MixtureOfBitexts.create_from_files(text_files, lps, 3, seed=7)
+        expected = [mix.next_batch() for _ in range(25)]
+        mix = MixtureOfBitexts.create_from_files(text_files, lps, 3, seed=7)
+        with PrefetchingBatchProducer(mix, num_batches=4) as prefetcher:
+            result = [prefetcher.next_batch() for _ in range(25)]
+        self.assertEqual(expected, result)
+
+    def test_prefetching_stops_at_end_of_data(self):
+        text_files = {"lang1": "test_files/lang1.txt", "lang2": "test_files/lang2.txt"}
+        mix = MixtureOfBitexts.create_from_files(
+            text_files, [("lang1", "lang2", None)], batch_size=5, only_once_thru=True
+        )
+        with PrefetchingBatchProducer(mix, num_batches=2) as prefetcher:
+            batches = [prefetcher.next_batch() for _ in range(6)]
+        self.assertEqual([batch is None for batch in batches], [False] * 4 + [True] * 2)
+
+    def test_prefetching_propagates_exceptions(self):
+        class FailingBatches:
+            def __init__(self):
+                self.calls = 0
+
+            def next_batch(self):
+                self.calls += 1
+                if self.calls == 3:
+                    raise ValueError("bad batch")
+                return self.calls
+
+        with PrefetchingBatchProducer(FailingBatches(), num_batches=2) as prefetcher:
+            self.assertEqual(prefetcher.next_batch(), 1)
+            self.assertEqual(prefetcher.next_batch(), 2)
+            with self.assertRaises(ValueError):
+                prefetcher.next_batch()
+            self.assertIsNone(prefetcher.next_batch())
+
+    def test_token_budget_batches(self):
+        bitext = Bitext("test_files/lang1.txt", "test_files/lang2.txt")
+        mix = MixtureOfBitexts(
+            {("lang1", "lang2"): bitext}, 2, only_once_thru=True, seed=0, max_tokens=30, shuffle_window=8
+        )
+        seen = []
+        batch = mix.next_batch()
+        while batch is not None:
+            src, tgt, _, _ = batch
+            padded_size = len(src) * (max(word_counts(src)) + max(word_counts(tgt)))
+            self.assertTrue(padded_size <= 30 or len(src) == 1)
+            seen.extend(zip(src, tgt))
+            batch = mix.next_batch()
+        self.assertCountEqual(seen, list(bitext))
+
+    def test_token_budget_batches_groups_similar_lengths(self):
+        bitext = Bitext("test_files/lang1.txt", "test_files/lang2.txt")
+        mix = MixtureOfBitexts(
+            {("lang1", "lang2"): bitext}, 2, only_once_thru=True, seed=0, max_tokens=40, shuffle_window=20
+        )
+        length_ranges = []
+        batch = mix.next_batch()
+        while batch is not None:
+            src, tgt, _, _ = batch
+            lengths = [s + t for s, t in zip(word_counts(src), word_counts(tgt))]
+            length_ranges.append((min(lengths), max(lengths)))
+            batch = mix.next_batch()
+        self.assertGreater(len(length_ranges), 1)
+        length_ranges.sort()
+        for (_, prev_max), (next_min, _) in zip(length_ranges, length_ranges[1:]):
+            self.assertLessEqual(prev_max, next_min)
+
+    def test_token_budget_batches_of_encoded_lines(self):
+        encoded_lines = []
+
+        def encode_words(sents, corpus):
+            encoded_lines.extend(sents)
+            return [[len(corpus[0])] + [len(word) for word in sent.split()] for sent in sents]
+
+        bitext = Bitext("test_files/lang1.txt", "test_files/lang2.txt", lines=[1, 18])
+        mix = MixtureOfBitexts(
+            {(("c", "lang1"), ("cc", "lang2")): bitext}, 2, only_once_thru=True, seed=0, max_tokens=30,
+            shuffle_window=8, collate_fn=lambda batch: tuple(zip(*batch)), lengths_fn=lambda ids: [len(x) for x in ids],
+            rank=1, world_size=2, encode_fn=encode_words
+        )
+        seen = []
+        batch = mix.next_batch()
+        while batch is not None:
+            src, tgt, _, _ = batch
+            self.assertTrue(len(src) * (max(map(len, src)) + max(map(len, tgt))) <= 30 or len(src) == 1)
+            seen.extend(zip(src, tgt))
+            batch = mix.next_batch()
+        shard = list(Shard(bitext, 1, 2))
+        expected = [(encode_words([s], ("c",))[0], encode_words([t], ("cc",))[0]) for s, t in shard]
+        self.assertCountEqual(seen, expected)
+        self.assertEqual(len(encoded_lines), 4 * len(shard)) # both sides of each line, by the mixture and for `expected`
+
+    def test_carriage_returns_do_not_shift_lines(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            text_file = os.path.join(tmp_dir, "text.txt")
+            with open(text_file, "wb") as writer:
+                writer.write("zero\rstill zero\r\none\ntwo é\r\nthree".encode("utf-8"))
+            self.assertEqual(len(LineIndex.for_file(text_file)), 4)
+            self.assertEqual(list(stream_lines(text_file)), ["zero\rstill zero", "one", "two é", "three"])
+            self.assertEqual(list(stream_lines(text_file, 2, 3)), ["two é"])
+
+    def test_encoded_bitext_skips_without_encoding(self):
+        encoded_lines = []
+
+        def encode(sents, corpus):
+            encoded_lines.extend(sents)
+            return [[len(sent)] for sent in sents]
+
+        bitext = Bitext("test_files/lang1.txt", "test_files/lang2.txt")
+        encoded = EncodedBitext(bitext, encode, ("lang1", "lang2"), chunk_size=3)
+        self.assertEqual(list(encoded.skip(5)), list(encoded)[5:])
+        self.assertEqual(len(encoded_lines), 2 * (len(list(bitext)) - 5) + 2 * len(list(bitext)))
+
+    def _check_resumption(self, make_mix, num_before=7, num_after=12):
+        mix = make_mix()
+        for _ in range(num_before):
+            mix.next_batch()
+        state = mix.state_dict()
+        expected = [mix.next_batch() for _ in range(num_after)]
+        resumed = make_mix()
+        resumed.load_state_dict(state)
+        self.assertEqual([resumed.next_batch() for _ in range(num_after)], expected)
+
+    def test_resume_fixed_size_batches(self):
+        text_files = {
+            "lang1": "test_files/lang1.txt",
+            "lang2": "test_files/lang2.txt",
+            "lang3": "test_files/lang3.txt",
+        }
+        lps = [("lang1", "lang2", None), ("lang1", "lang3", [5, 20])]
+        self._check_resumption(lambda: MixtureOfBitexts.create_from_files(text_files, lps, 3, seed=7))
+
+    def test_resume_token_budget_batches(self):
+        bitexts = {
+            ("lang1", "lang2"): Bitext("test_files/lang1.txt", "test_files/lang2.txt"),
+            ("lang1", "lang3"): Bitext("test_files/lang1.txt", "test_files/lang3.txt", lines=[2, 18]),
+        }
+        self._check_resumption(
+            lambda: MixtureOfBitexts(bitexts, 2, seed=3, max_tokens=30, shuffle_window=6), num_before=9
+        )
+
+    def test_resume_token_budget_batches_of_encoded_lines(self):
+        bitexts = {("lang1", "lang2"): Bitext("test_files/lang1.txt", "test_files/lang2.txt")}
+        self._check_resumption(
+            lambda: MixtureOfBitexts(
+                bitexts, 2, seed=3, max_tokens=12, shuffle_window=6, lengths_fn=lambda ids: [len(x) for x in ids],
+                encode_fn=lambda sents, corpus: [tuple(len(word) for word in sent.split()) for sent in sents]
+            ),
+            num_before=9
+        )
+
+    def test_resume_after_prefetching(self):
+        text_files = {"lang1": "test_files/lang1.txt", "lang2": "test_files/lang2.txt"}
+        lps = [("lang1", "lang2", None)]
+        mix = MixtureOfBitexts.create_from_files(text_files, lps, 2, seed=1)
+        with PrefetchingBatchProducer(mix, num_batches=4) as prefetcher:
+            for _ in range(5):
+                prefetcher.next_batch()
+            state = prefetcher.state_dict()
+            expected = [prefetcher.next_batch() for _ in range(6)]
+        resumed = MixtureOfBitexts.create_from_files(text_files, lps, 2, seed=1)
+        resumed.load_state_dict(state)
+        self.assertEqual([resumed.next_batch() for _ in range(6)], expected)
+
+    def test_shards_are_disjoint(self):
+        bitext = Bitext("test_files/lang1.txt", "test_files/lang2.txt", lines=[1, 18])
+        shards = [list(Shard(bitext, rank, 3)) for rank in range(3)]
+        self.assertEqual(sorted(sum(shards, [])), sorted(bitext))
+        self.assertEqual(shards[1][2:], list(Shard(bitext, 1, 3).skip(2)))
+
+    def test_ranks_draw_disjoint_batches(self):
+        bitexts = {("lang1", "lang2"): Bitext("test_files/lang1.txt", "test_files/lang2.txt")}
+        seen = []
+        for rank in range(2):
+            mix = MixtureOfBitexts(bitexts, 3, only_once_thru=True, rank=rank, world_size=2)
+            batch = mix.next_batch()
+            while batch is not None:
+                seen.extend(zip(batch[0], batch[1]))
+                batch = mix.next_batch()
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(len(seen), 18)
+
+    def test_materialize_batches(self):
+        with open("test_files/example_config.json") as f:
+            config = json.load(f)
+        mix = MixtureOfBitexts.create_from_config(config, "dev", only_once_thru=True)
+        batches = materialize_batches(mix, max_batches=100)
+        # each 4-line dev bitext yields two batches of 2
+        self.assertCountEqual(
+            [batch[3] for batch in batches], [("l1-l2", "lang2")] * 2 + [("l1-l3", "lang3")] * 2
+        )
+        mix = MixtureOfBitexts.create_from_config(config, "dev", only_once_thru=False)
+        self.assertEqual(len(materialize_batches(mix, max_batches=5)), 5)
+
     def test_tokenized_mixture_of_bitexts(self):
         text_files = {
             ("test", "eng"): "test_files/lang1.txt",
@@ -0,0 +1,73 @@
+import copy
+import json
+import os
+import tempfile
+import unittest
+from corpora import LineIndex
+from dry_run import bitext_statistics, check_config, tokens_per_step
+from pretokenized import TokenizedText, file_digest
+
+
+def load_config():
+    with open("test_files/example_config.json") as reader:
+        config = json.load(reader)
+    config["finetuning_parameters"].update({"report_every": 10, "validate_every": 100, "patience": 5})
+    return config
+
+
+class TestDryRun(unittest.TestCase):
+    def test_valid_config(self):
+        config = load_config()
+        self.assertEqual(check_config(config), [])
+        statistics = bitext_statistics(config)
+        self.assertEqual([s["lines"] for s in statistics], [8, 8])
+        self.assertTrue(all(s["unit"] == "words" and s["src_tokens"] > 0 for s in statistics))
+        per_line = [(s["src_tokens"] + s["tgt_tokens"]) / 8 for s in statistics]
+        self.assertAlmostEqual(tokens_per_step(config, statistics), sum(per_line) / len(per_line) * 2) # batch_size 2
+
+    def test_exact_counts_from_compiled_corpora(self):
+        config = load_config()
+        with tempfile.TemporaryDirectory() as compiled_dir:
+            config["finetuning_parameters"]["compiled_corpora"] = compiled_dir
+            for corpus in config["corpora"].values():
+                for corpus_config in corpus.values():
+                    prefix = os.path.join(
+                        compiled_dir, "facebook--nllb-200-distilled-600M.max128.0123456789",
+                        corpus_config["lang_code"], file_digest(corpus_config["train"])
+                    )
+                    if not TokenizedText.exists(prefix):
+                        TokenizedText.compile(corpus_config["train"], lambda lines: [[7] * 3 for _ in lines], prefix)
+            statistics = bitext_statistics(config)
+        self.assertEqual([(s["src_tokens"], s["tgt_tokens"], s["unit"]) for s in statistics], [(24, 24, "tokens")] * 2)
+
+    def test_train_lines_past_end_of_file(self):
+        config = load_config()
+        config["bitexts"][1]["train_lines"] = [8, 40]
+        errors = check_config(config)
+        self.assertEqual(len(errors), 2) # one per side of the bitext
+        self.assertTrue(all("goes past the end" in error for error in errors))
+
+    def test_null_train_lines_means_all_lines(self):
+        config = load_config()
+        config["bitexts"][0]["train_lines"] = None
+        self.assertEqual(check_config(config), [])
+        statistics = bitext_statistics(config)
+        self.assertEqual(statistics[0]["lines"], len(LineIndex.for_file(config["corpora"]["l1-l2"]["lang1"]["train"])))
+
+    def test_missing_and_misaligned_files(self):
+        config = load_config()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            short_file = os.path.join(tmp_dir, "short.txt")
+            with open(short_file, "w") as writer:
+                writer.write("one line\n")
+            broken = copy.deepcopy(config)
+            broken["corpora"]["l1-l2"]["lang2"]["dev"] = short_file
+            broken["corpora"]["l1-l3"]["lang3"]["test"] = os.path.join(tmp_dir, "missing.txt")
+            errors = check_config(broken)
+        self.assertEqual(len(errors), 2)
+        self.assertIn("l1-l2: dev files are not line-aligned", errors[0])
+        self.assertIn("does not exist", errors[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import json
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from metrics import METRICS_FILE, PhaseTimer, append_metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def test_phases_and_tokens_are_reported(self):
+        timer = PhaseTimer()
+        for _ in range(2):
+            with timer.phase("data"):
+                time.sleep(0.02)
+            timer.split("data", {"tokenize": 0.01})
+            with timer.phase("forward"):
+                time.sleep(0.01)
+            timer.end_step(100, 30)
+        record = timer.report(step=2)
+        self.assertEqual((record["steps"], record["real_tokens"], record["pad_tokens"]), (2, 140, 60))
+        self.assertAlmostEqual(record["phase_seconds"]["tokenize"], 0.02)
+        self.assertGreaterEqual(record["phase_seconds"]["data"], 0.02)
+        self.assertGreaterEqual(record["phase_seconds"]["forward"], 0.02)
+        self.assertAlmostEqual(sum(record["phase_percent"].values()), 100.0, places=3)
+        self.assertAlmostEqual(record["tokens_per_second"], 200 / record["seconds"])
+        self.assertEqual(timer.report(step=3)["steps"], 0) # a report starts a new interval
+
+    def test_synchronizes_per_phase_only_when_asked(self):
+        calls = []
+        timer = PhaseTimer(synchronize=lambda: calls.append(1))
+        for _ in range(3):
+            with timer.phase("forward"):
+                pass
+        self.assertEqual(len(calls), 0)
+        timer.report(step=3)
+        self.assertEqual(len(calls), 1) # once per report
+        profiler = PhaseTimer(synchronize=lambda: calls.append(1), sync_phases=True)
+        for _ in range(3):
+            with profiler.phase("forward"):
+                pass
+        self.assertEqual(len(calls), 4)
+
+    def test_records_are_appended(self):
+        with tempfile.TemporaryDirectory() as model_dir:
+            append_metrics(model_dir, {"step": 1})
+            append_metrics(model_dir, {"step": 2})
+            with open(Path(model_dir) / METRICS_FILE) as reader:
+                self.assertEqual([json.loads(line)["step"] for line in reader], [1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import tempfile
+import unittest
+import torch
+from transformers import AutoModelForSeq2SeqLM, M2M100Config, M2M100ForConditionalGeneration
+from model_loading import load_pretrained, unshare_trainable_parameters
+
+
+def save_tiny_model(model_dir):
+    config = M2M100Config(
+        vocab_size=64, d_model=16, encoder_layers=1, decoder_layers=1,
+        encoder_attention_heads=2, decoder_attention_heads=2,
+        encoder_ffn_dim=32, decoder_ffn_dim=32, max_position_embeddings=32,
+    )
+    M2M100ForConditionalGeneration(config).save_pretrained(model_dir)
+
+
+class TestModelLoading(unittest.TestCase):
+    def test_mapped_model_matches_from_pretrained(self):
+        with tempfile.TemporaryDirectory() as model_dir:
+            save_tiny_model(model_dir)
+            expected = AutoModelForSeq2SeqLM.from_pretrained(model_dir)
+            model, mapped = load_pretrained(model_dir)
+            self.assertTrue(mapped)
+            self.assertIs(model.lm_head.weight, model.model.shared.weight)
+            expected_state, state = expected.state_dict(), model.state_dict()
+            self.assertEqual(set(state), set(expected_state))
+            for name in expected_state:
+                self.assertTrue(torch.equal(state[name], expected_state[name]), name)
+            input_ids = torch.tensor([[5, 6, 7, 2]])
+            self.assertTrue(
+                torch.allclose(
+                    model(input_ids=input_ids, labels=input_ids).loss,
+                    expected(input_ids=input_ids, labels=input_ids).loss,
+                )
+            )
+
+    def test_only_trainable_parameters_are_copied(self):
+        with tempfile.TemporaryDirectory() as model_dir:
+            save_tiny_model(model_dir)
+            cache = dict()
+            model, _ = load_pretrained(model_dir, cache=cache)
+            for param in model.get_encoder().parameters():
+                param.requires_grad = False
+            unshare_trainable_parameters(model)
+            mapped = cache[model_dir]
+            frozen = model.get_encoder().layers[0].fc1.weight
+            trained = model.get_decoder().layers[0].fc1.weight
+            self.assertEqual(frozen.data_ptr(), mapped["model.encoder.layers.0.fc1.weight"].data_ptr())
+            self.assertNotEqual(trained.data_ptr(), mapped["model.decoder.layers.0.fc1.weight"].data_ptr())
+            with torch.no_grad():
+                trained.add_(1.0)
+            reloaded, _ = load_pretrained(model_dir, cache=cache)
+            self.assertEqual(reloaded.get_encoder().layers[0].fc1.weight.data_ptr(), frozen.data_ptr())
+            self.assertFalse(torch.equal(reloaded.get_decoder().layers[0].fc1.weight, trained))
+
+if __name__ == "__main__":
+    unittest.main()
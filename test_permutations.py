@@ -1,5 +1,13 @@
+import os
+import tempfile
 import unittest
-from permutations import create_random_permutation_with_fixed_points
+import torch
+from permutations import (
+    Permutation,
+    create_random_permutation_with_fixed_points,
+    load_permutation_map,
+    save_permutation_map,
+)
 
 
 class TestPermutations(unittest.TestCase):
@@ -21,6 +29,46 @@ class TestPermutations(unittest.TestCase):
     def test_permutation_call(self):
         pmap = create_random_permutation_with_fixed_points(3, [])
         self.assertIsInstance(pmap(0), int)
+
+    def test_permute_matches_call(self):
+        pmap = create_random_permutation_with_fixed_points(50, [0, 1, 2, 49])
+        token_ids = torch.tensor([[5, 0, 49, 17, -100], [48, 3, 2, 1, 60]])
+        expected = [[pmap(i) for i in row] for row in token_ids.tolist()]
+        self.assertEqual(pmap.permute(token_ids).tolist(), expected)
+        self.assertEqual(pmap(-100), -100)
+        self.assertEqual(pmap(60), 60)
+
+    def test_inverse(self):
+        pmap = Permutation([3, 4, 5], [5, 3, 4])
+        inverse = pmap.get_inverse()
+        self.assertIs(inverse, pmap.get_inverse())
+        self.assertIs(inverse.get_inverse(), pmap)
+        token_ids = torch.tensor([[0, 3, 4, 5, 6, -100]])
+        self.assertEqual(inverse.permute(pmap.permute(token_ids)).tolist(), token_ids.tolist())
+        self.assertEqual([inverse(i) for i in range(7)], [0, 1, 2, 4, 5, 3, 6])
+
+
+    def test_save_and_load_binary(self):
+        p1 = create_random_permutation_with_fixed_points(300, [0, 1, 2])
+        p2 = create_random_permutation_with_fixed_points(300, [0, 1, 2])
+        pmap = {("europarl", "tsn"): p1, ("europarl", "tso"): p2, ("bible", "tsn"): p1}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, "permutations.bin")
+            save_permutation_map(pmap, filename)
+            self.assertLess(os.path.getsize(filename), 3 * 300 * 4)
+            loaded = load_permutation_map(filename)
+        self.assertEqual(set(loaded), set(pmap))
+        for key in pmap:
+            self.assertEqual(loaded[key].table.tolist(), pmap[key].table.tolist())
+        self.assertIs(loaded[("europarl", "tsn")], loaded[("bible", "tsn")])
+
+    def test_load_json(self):
+        pmap = {("europarl", "tsn"): Permutation([3, 4, 5], [5, 3, 4])}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, "permutations.json")
+            save_permutation_map(pmap, filename)
+            loaded = load_permutation_map(filename)
+        self.assertEqual([loaded[("europarl", "tsn")](i) for i in range(7)], [0, 1, 2, 5, 3, 4, 6])
         
         
 if __name__ == "__main__":
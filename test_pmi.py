@@ -0,0 +1,112 @@
+import math
+import random
+import sys
+import unittest
+from pathlib import Path
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent / "scripts"))
+from pmi import EXCLUDED_TOKENS, LineCounts, TokenCounts, adjacent_pair_pmi, lines_with, pmi_ranking
+
+
+def flatten(lines):
+    ids = np.array([token for line in lines for token in line], dtype=np.int32)
+    offsets = np.concatenate([[0], np.cumsum([len(line) for line in lines])]).astype(np.int64)
+    return ids, offsets
+
+
+def random_lines(rng, num_lines, vocab):
+    return [[rng.choice(vocab) for _ in range(rng.randint(0, 8))] for _ in range(num_lines)]
+
+
+def reference_ranking(lines1, lines2, filter_num):
+    """The per-line loops that similarity_index.py used to run."""
+    mutual_token_count = {}
+    for tokenized1, tokenized2 in zip(lines1, lines2):
+        for token_id in tokenized1:
+            if token_id in tokenized2 and token_id not in EXCLUDED_TOKENS:
+                mutual_token_count[token_id] = mutual_token_count.get(token_id, 0) + 1
+    mutual_token_count = {k: v for k, v in mutual_token_count.items() if v > filter_num}
+    token_pmi = {}
+    for token_num, count in mutual_token_count.items():
+        in_first = sum(1 for tokenized1 in lines1 if token_num in tokenized1)
+        in_second = sum(1 for tokenized2 in lines2 if token_num in tokenized2)
+        token_pmi[token_num] = math.log2((count*len(lines1))/(in_second*in_first))
+    return sorted(token_pmi.items(), key=lambda kv: kv[1], reverse=True)
+
+
+def is_directly_after(lst, elem1, elem2):
+    for i in range(len(lst) - 1):
+        if lst[i] == elem1 and lst[i + 1] == elem2:
+            return True
+    return False
+
+
+def reference_pair_pmi(lines, token1, token2):
+    """The per-line counting that extract_vocab.py used to do for one candidate pair."""
+    counter = [0, 0, 0]
+    for tokenized in lines:
+        if token1 in tokenized:
+            counter[0] += 1
+            if token2 in tokenized and is_directly_after(tokenized, token1, token2):
+                counter[1] += 1
+                counter[2] += 1
+        elif token2 in tokenized:
+            counter[1] += 1
+    r = (counter[2]*len(lines))/(counter[0]*counter[1]) if (counter[0] != 0 and counter[1] != 0) else 0
+    return math.log2(r) if r > 0 else 0
+
+
+class TestPmiRanking(unittest.TestCase):
+    def test_matches_per_line_loops(self):
+        rng = random.Random(0)
+        vocab = [0, 2, 3] + list(range(10, 22)) # includes excluded special tokens
+        num_ties = 0
+        for trial in range(20):
+            num_lines = rng.randint(1, 40)
+            lines1, lines2 = random_lines(rng, num_lines, vocab), random_lines(rng, num_lines, vocab)
+            counts1, counts2 = TokenCounts(*flatten(lines1), vocab_size=32), TokenCounts(*flatten(lines2), vocab_size=32)
+            for filter_num in [0, 2]:
+                expected = reference_ranking(lines1, lines2, filter_num)
+                ranking = pmi_ranking(counts1, counts2, filter_num)
+                self.assertEqual(ranking, expected) # same tokens, PMIs and order of ties
+                pmis = [pmi for _, pmi in ranking]
+                num_ties += len(pmis) - len(set(pmis))
+        self.assertGreater(num_ties, 0) # the tie order was exercised
+
+    def test_misaligned_files(self):
+        with self.assertRaises(ValueError):
+            pmi_ranking(TokenCounts(*flatten([[10], [11]]), vocab_size=12), TokenCounts(*flatten([[10]]), vocab_size=12))
+        with self.assertRaises(ValueError): # counted with different vocabulary sizes
+            pmi_ranking(TokenCounts(*flatten([[10]]), vocab_size=12), TokenCounts(*flatten([[10]]), vocab_size=16))
+
+    def test_lines_with(self):
+        lines = [[4, 5, 4], [], [5], [4], [6, 4]]
+        self.assertEqual(lines_with(*flatten(lines), 4).tolist(), [0, 3, 4])
+        self.assertEqual(lines_with(*flatten(lines), 7).tolist(), [])
+
+
+class TestLineCounts(unittest.TestCase):
+    def test_adjacent_pair_pmi_matches_per_line_loop(self):
+        rng = random.Random(1)
+        for trial in range(20):
+            lines = random_lines(rng, rng.randint(1, 50), list(range(8)))
+            counts = LineCounts(*flatten(lines), vocab_size=10)
+            pairs = [(rng.randrange(8), rng.randrange(8)) for _ in range(30)]
+            pairs += [(3, 3), (8, 9), (9, 3), (3, 9)] # a token after itself; tokens that never occur
+            pmis = adjacent_pair_pmi(counts, pairs)
+            for (token1, token2), pmi in zip(pairs, pmis):
+                expected = reference_pair_pmi(lines, token1, token2)
+                self.assertEqual((pmi, type(pmi)), (expected, type(expected)), (trial, token1, token2))
+
+    def test_pairs_are_counted_once_per_line(self):
+        counts = LineCounts(*flatten([[5, 6, 5, 6], [6, 5], [5, 6, 6]]), vocab_size=7)
+        self.assertEqual(counts.bigrams(np.array([5, 6, 6, 5]), np.array([6, 5, 6, 5])).tolist(), [2, 2, 1, 0])
+        self.assertEqual(counts.unigrams[[5, 6]].tolist(), [3, 3])
+        self.assertEqual(counts.cooccurrences(np.array([5, 5]), np.array([6, 5])).tolist(), [3, 3])
+        empty = LineCounts(*flatten([[], [4]]), vocab_size=7)
+        self.assertEqual(empty.bigrams(np.array([4]), np.array([4])).tolist(), [0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+from corpora import MixtureOfBitexts
+from pretokenized import (
+    PretokenizedBitext,
+    PretokenizedMixtureOfBitexts,
+    TokenizedText,
+    collate_token_ids,
+    load_or_tokenize,
+)
+
+
+def encode_words(lines):
+    return [[len(word) for word in line.split()] + [2] for line in lines]
+
+
+class WordLengthTokenizer:
+    """Stands in for a Hugging Face tokenizer, counting how many lines it tokenizes."""
+    name_or_path = "test/word-lengths"
+    all_special_tokens = ["</s>"]
+    all_special_ids = [2]
+
+    def __init__(self, src_lang):
+        self.src_lang = src_lang
+        self.num_lines = 0
+
+    def __len__(self):
+        return 100
+
+    def __call__(self, lines):
+        self.num_lines += len(lines)
+        return {"input_ids": encode_words(lines)}
+
+
+class TestPretokenized(unittest.TestCase):
+    def test_compile_and_read(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            prefix = os.path.join(tmp_dir, "lang1")
+            text = TokenizedText.compile("test_files/lang1.txt", encode_words, prefix, chunk_size=3)
+            self.assertTrue(TokenizedText.exists(prefix))
+            with open("test_files/lang1.txt") as reader:
+                expected = encode_words([line.rstrip("\n") for line in reader])
+            self.assertEqual(len(text), len(expected))
+            self.assertEqual([text[i].tolist() for i in range(len(text))], expected)
+            self.assertEqual(text.lengths().tolist(), [len(ids) for ids in expected])
+
+    def test_load_or_tokenize_caches(self):
+        tokenizer = WordLengthTokenizer("eng_Latn")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            text = load_or_tokenize(tmp_dir, tokenizer, "test_files/lang1.txt")
+            num_lines = tokenizer.num_lines
+            cached = load_or_tokenize(tmp_dir, tokenizer, "test_files/lang1.txt")
+            self.assertEqual(tokenizer.num_lines, num_lines) # read back, not tokenized again
+            self.assertEqual(cached.ids.tolist(), text.ids.tolist())
+            self.assertEqual(cached.prefix, text.prefix)
+            tokenizer.src_lang = "fra_Latn"
+            self.assertNotEqual(load_or_tokenize(tmp_dir, tokenizer, "test_files/lang1.txt").prefix, text.prefix)
+            self.assertEqual(tokenizer.num_lines, 2 * num_lines)
+
+    def test_pretokenized_mixture(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            lang1 = TokenizedText.compile("test_files/lang1.txt", encode_words, os.path.join(tmp_dir, "lang1"))
+            lang2 = TokenizedText.compile("test_files/lang2.txt", encode_words, os.path.join(tmp_dir, "lang2"))
+            bitext = PretokenizedBitext(lang1, lang2, lines=[4, 6])
+            mix = MixtureOfBitexts({("lang1", "lang2"): bitext}, 2, collate_fn=collate_token_ids)
+            pmap = {"lang2": lambda x: x + 1}
+            pretokenized = PretokenizedMixtureOfBitexts(mix, pad_token_id=1, permutation_map=pmap)
+            x, y, src, tgt = pretokenized.next_batch()
+            # "He drinks coffee." / "We watched a movie."
+            self.assertEqual(x.input_ids.tolist(), [[2, 6, 7, 2, 1], [2, 7, 1, 6, 2]])
+            self.assertEqual(x.attention_mask.tolist(), [[1, 1, 1, 1, 0], [1, 1, 1, 1, 1]])
+            # "Il boit du café." / "Nous avons regardé un film." (permuted by +1)
+            self.assertEqual(
+                y.input_ids.tolist(), [[3, 5, 3, 6, 3, -99], [5, 6, 8, 3, 6, 3]]
+            )
+            self.assertEqual((src, tgt), ("lang1", "lang2"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from sweep import is_complete, model_dirs, resumable_model_dir
+
+
+class TestSweep(unittest.TestCase):
+    def test_finds_complete_and_resumable_runs(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = {"model_dir": os.path.join(tmp_dir, "exp")}
+            self.assertEqual(model_dirs(config), [])
+            self.assertFalse(is_complete(config))
+            for version in [0, 2, 10]:
+                os.makedirs(f"{config['model_dir']}-v{version}")
+            os.makedirs(f"{config['model_dir']}-vx")
+            os.makedirs(f"{config['model_dir']}-extra-v1")
+            self.assertEqual(
+                model_dirs(config), [f"{config['model_dir']}-v{version}" for version in [0, 2, 10]]
+            )
+            self.assertIsNone(resumable_model_dir(config))
+            os.makedirs(f"{config['model_dir']}-v2/checkpoint")
+            Path(f"{config['model_dir']}-v2/checkpoint/training_state.pt").touch()
+            self.assertEqual(resumable_model_dir(config), f"{config['model_dir']}-v2")
+            self.assertFalse(is_complete(config))
+            Path(f"{config['model_dir']}-v10/scores.json").touch()
+            self.assertTrue(is_complete(config))
+
+
+if __name__ == "__main__":
+    unittest.main()
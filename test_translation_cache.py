@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from translation_cache import TranslationCache, saved_model_fingerprint
+
+
+class TestTranslationCache(unittest.TestCase):
+    def test_keys(self):
+        key = TranslationCache.key("model", [256047, 17, 2], "fra_Latn", {"num_beams": 4, "a": 32, "b": 3})
+        same = TranslationCache.key("model", [256047, 17, 2], "fra_Latn", {"b": 3, "a": 32, "num_beams": 4})
+        self.assertEqual(key, same)
+        self.assertNotEqual(key, TranslationCache.key("model", [256047, 17, 2], "deu_Latn", {"num_beams": 4, "a": 32, "b": 3}))
+        self.assertNotEqual(key, TranslationCache.key("model", [256047, 17, 2], "fra_Latn", {"num_beams": 1, "a": 32, "b": 3}))
+        self.assertNotEqual(key, TranslationCache.key("other", [256047, 17, 2], "fra_Latn", {"num_beams": 4, "a": 32, "b": 3}))
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "cache.db")
+            cache = TranslationCache(path)
+            cache.put_many({"k1": "Le chat a dormi.", "k2": "Elle court vite."})
+            cache.close()
+            cache = TranslationCache(path)
+            self.assertEqual(cache.get_many(["k1", "k3"]), {"k1": "Le chat a dormi."})
+            cache.close()
+
+    def test_lru_eviction(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = TranslationCache(os.path.join(tmp_dir, "cache.db"), max_bytes=30)
+            cache.put_many({"k1": "aaaaaaaa"})
+            cache.put_many({"k2": "bbbbbbbb"})
+            cache.put_many({"k3": "cccccccc"})
+            cache.get_many(["k1"])  # k2 is now the least recently used
+            cache.put_many({"k4": "dddddddd"})
+            self.assertLessEqual(cache.total_bytes(), 30)
+            self.assertEqual(set(cache.get_many(["k1", "k2", "k3", "k4"])), {"k1", "k3", "k4"})
+            cache.close()
+
+    def test_saved_model_fingerprint(self):
+        with tempfile.TemporaryDirectory() as model_dir:
+            weights = Path(model_dir) / "model.safetensors"
+            weights.write_bytes(b"weights")
+            (Path(model_dir) / "config.json").write_text("{}")
+            fingerprint = saved_model_fingerprint(model_dir)
+            (Path(model_dir) / "scores.json").write_text("{}")
+            self.assertEqual(saved_model_fingerprint(model_dir), fingerprint)
+            weights.write_bytes(b"new weights")
+            self.assertNotEqual(saved_model_fingerprint(model_dir), fingerprint)
+
+
+if __name__ == "__main__":
+    unittest.main()
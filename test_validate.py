@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import sacrebleu
+import torch
+from translation_cache import TranslationCache
+from validate import TranslationScorer, length_sorted_batches, translate_segments
+
+
+class EchoTokenizer:
+    """One token per character; the stub model "translates" a segment into itself."""
+
+    def encode(self, sents, lang_code=None):
+        return [[ord(c) for c in sent] + [2] for sent in sents]
+
+    def get_special_tokens(self):
+        return {"<pad>": 1, "</s>": 2, "fra_Latn": 3}
+
+    def batch_decode(self, token_ids):
+        return ["".join(chr(t) for t in row if t > 3) for row in token_ids.tolist()]
+
+
+class EchoModel:
+    device = torch.device("cpu")
+
+    def __init__(self):
+        self.batches = []
+
+    def eval(self):
+        pass
+
+    def generate(self, input_ids, attention_mask, **kwargs):
+        self.batches.append([row[mask.bool()].tolist() for row, mask in zip(input_ids, attention_mask)])
+        return input_ids
+
+
+class TestValidate(unittest.TestCase):
+    def test_length_sorted_batches(self):
+        lengths = [5, 12, 3, 12, 7, 4, 30]
+        batches = length_sorted_batches(lengths, max_tokens=24)
+        self.assertEqual(batches, [[6], [1, 3], [4, 0, 5], [2]])
+        self.assertCountEqual([k for batch in batches for k in batch], range(len(lengths)))
+
+    def test_length_sorted_batches_empty(self):
+        self.assertEqual(length_sorted_batches([], max_tokens=24), [])
+
+
+    def test_scorer_matches_sacrebleu(self):
+        # TranslationScorer computes scores from sacrebleu's private per-segment statistics, so check
+        # every score against the public API of the installed sacrebleu
+        hyps = ["The cat sat on the mat.", "He drinks coffee every day", "Nothing", "We watched a film.", ""]
+        refs = ["The cat sat on a mat.", "He drinks coffee.", "Something else entirely", "We watched a movie.", "Empty"]
+        scorer = TranslationScorer(sentence_scores=True, bootstrap_samples=20, seed=3)
+        scores = scorer.score_all({"eng_Latn->fra_Latn": hyps}, {"eng_Latn->fra_Latn": refs})["eng_Latn->fra_Latn"]
+        for name, metric in scorer.metrics.items():
+            self.assertEqual(scores[name], round(metric.corpus_score(hyps, [refs]).score, 3))
+            sentence_metric = scorer.sentence_metrics[name]
+            self.assertEqual(
+                scores["sentences"][name],
+                [round(sentence_metric.sentence_score(hyp, [ref]).score, 3) for hyp, ref in zip(hyps, refs)],
+            )
+            rng = np.random.default_rng(3)
+            samples = []
+            for _ in range(20):
+                indices = rng.integers(0, len(hyps), len(hyps))
+                samples.append(metric.corpus_score([hyps[i] for i in indices], [[refs[i] for i in indices]]).score)
+            self.assertEqual(scores[f"{name}_ci"], [round(float(np.percentile(samples, q)), 3) for q in (2.5, 97.5)])
+        self.assertEqual(scores["bleu"], round(sacrebleu.corpus_bleu(hyps, [refs]).score, 3))
+        self.assertEqual(scores["chrf"], round(sacrebleu.corpus_chrf(hyps, [refs]).score, 3))
+    def test_translate_segments_in_original_order(self):
+        segments = ["a", "abcdef", "", "abc", "abcdefgh", "ab", "abc"]
+        tokenizer, model = EchoTokenizer(), EchoModel()
+        translations = translate_segments(segments, model, tokenizer, "eng_Latn", "fra_Latn", max_tokens=12)
+        self.assertEqual(translations, segments)
+        self.assertGreater(len(model.batches), 1)
+        translated = [tuple(ids) for batch in model.batches for ids in batch]
+        self.assertCountEqual(translated, [tuple(ids) for ids in tokenizer.encode(segments)]) # each exactly once
+
+    def test_cached_segments_are_not_translated_again(self):
+        segments = ["abc", "a", "abcdef", "abc"]
+        tokenizer, model = EchoTokenizer(), EchoModel()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = TranslationCache(os.path.join(tmp_dir, "cache.db"))
+            first = translate_segments(segments[:2], model, tokenizer, "eng_Latn", "fra_Latn", cache=cache, fingerprint="m")
+            num_batches = len(model.batches)
+            translations = translate_segments(segments, model, tokenizer, "eng_Latn", "fra_Latn", cache=cache, fingerprint="m")
+            self.assertEqual(model.batches[num_batches:], [[tokenizer.encode(["abcdef"])[0]]]) # only the new segment
+            num_batches = len(model.batches)
+            again = translate_segments(segments, model, tokenizer, "eng_Latn", "fra_Latn", cache=cache, fingerprint="m")
+            self.assertEqual(len(model.batches), num_batches) # no generation at all
+            translate_segments(segments, model, tokenizer, "eng_Latn", "fra_Latn", cache=cache, fingerprint="other")
+            self.assertGreater(len(model.batches), num_batches)
+            cache.close()
+        self.assertEqual((first, translations, again), (segments[:2], segments, segments))
+
+
+if __name__ == "__main__":
+    unittest.main()
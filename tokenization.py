@@ -1,5 +1,5 @@
 import sys
-from transformers import AutoTokenizer
+import threading
 from typing import Dict, Tuple, List, Optional, Iterator, Callable
 import warnings
 from abc import ABC
@@ -31,7 +31,11 @@ class Tokenizer(ABC):
 class HuggingfaceTokenizer(Tokenizer):
     
     def __init__(self, model_name, max_length=None):
+        from transformers import AutoTokenizer  # slow to import, so only when a tokenizer is needed
+
+        self.model_name = model_name
         self.max_length = max_length        
+        self.lock = threading.Lock() # src_lang is shared state, so calls from different threads must not interleave
         with warnings.catch_warnings():
             warnings.filterwarnings(
                 "ignore",
@@ -51,15 +55,27 @@ class HuggingfaceTokenizer(Tokenizer):
         return len(self.tokenizer)
     
     def __call__(self, sents: List[str], lang_code=None):        
-        if lang_code is not None:
-            self.tokenizer.src_lang = lang_code
-        return self.tokenizer(
-            sents, 
-            return_tensors="pt",
-            padding=True,
-            truncation=True,
-            max_length=self.max_length if self.max_length is not None else None
-        )
+        with self.lock:
+            if lang_code is not None:
+                self.tokenizer.src_lang = lang_code
+            return self.tokenizer(
+                sents, 
+                return_tensors="pt",
+                padding=True,
+                truncation=True,
+                max_length=self.max_length if self.max_length is not None else None
+            )
+        
+    def encode(self, sents: List[str], lang_code=None) -> List[List[int]]:
+        """Tokenizes (and truncates) each sentence, without padding."""
+        with self.lock:
+            if lang_code is not None:
+                self.tokenizer.src_lang = lang_code
+            return self.tokenizer(
+                sents,
+                truncation=True,
+                max_length=self.max_length if self.max_length is not None else None
+            )["input_ids"]
         
     def get_special_tokens(self):
         return self.special_tokens
@@ -76,4 +92,26 @@ class HuggingfaceTokenizer(Tokenizer):
 class NllbTokenizer(HuggingfaceTokenizer):
     def __init__(self, size, max_length=None):
         super().__init__(f"facebook/nllb-200-distilled-{size}", max_length=max_length)
-        
\ No newline at end of file
+        
+
+
+def prepare_tokenizer(model_name: str, lang_codes: List[str], max_length: int = 128):
+    """
+    Loads the tokenizer for a base model and registers any language codes it does not know.
+
+    Returns the tokenizer and whether new special tokens were added (in which case the
+    model's token embeddings need to be resized).
+    """
+    if model_name == "facebook/nllb-200-distilled-600M":   
+        tokenizer = NllbTokenizer("600M", max_length=max_length)
+    elif model_name == "facebook/nllb-200-distilled-1.3B": 
+        tokenizer = NllbTokenizer("1.3B", max_length=max_length)
+    else:
+        tokenizer = HuggingfaceTokenizer(model_name, max_length=max_length)
+    special_tokens = list(tokenizer.get_special_tokens().keys())
+    langs_to_add = sorted(set(lang_codes) - set(special_tokens))
+    resize = (len(langs_to_add) > 0)
+    if resize:
+        print(f"Adding unrecognized lang codes: {langs_to_add}")
+    tokenizer.replace_special_tokens(special_tokens + langs_to_add)
+    return tokenizer, resize
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+
+def model_fingerprint(model) -> str:
+    """Hashes the names and values of a model's weights."""
+    import torch
+
+    sha = hashlib.sha1()
+    for name, tensor in sorted(model.state_dict().items()):
+        sha.update(name.encode("utf-8"))
+        sha.update(str(tensor.dtype).encode("utf-8"))
+        sha.update(tensor.detach().cpu().contiguous().flatten().view(torch.uint8).numpy().tobytes())
+    return sha.hexdigest()
+
+
+def saved_model_fingerprint(model_dir: str) -> str:
+    """
+    Hashes the path, size and modification time of the files of a model saved with
+    `save_pretrained`, which is much faster than hashing its weights (see `model_fingerprint`).
+    """
+    sha = hashlib.sha1(str(Path(model_dir).resolve()).encode("utf-8"))
+    for path in sorted(Path(model_dir).iterdir()):
+        if path.name in ("config.json", "generation_config.json") or path.suffix == ".safetensors" or (
+            path.name.startswith("pytorch_model")
+        ):
+            stat = path.stat()
+            sha.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    return sha.hexdigest()
+
+
+def permutation_fingerprint(permutation) -> str:
+    if permutation is None:
+        return "none"
+    return hashlib.sha1(permutation.table.numpy().tobytes()).hexdigest()
+
+
+class TranslationCache:
+    """
+    On-disk (SQLite) cache of translations, bounded in size with least-recently-used eviction.
+
+    A key identifies everything that determines a translation: the model, the source
+    token ids, the target language code, the permutations and the decoding parameters.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 1 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS translations "
+            "(key TEXT PRIMARY KEY, translation TEXT, size INTEGER, last_used INTEGER)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS by_last_used ON translations (last_used)")
+        self.connection.commit()
+
+    @staticmethod
+    def key(model_fingerprint: str, src_ids: List[int], tgt_code: str, decoding: dict) -> str:
+        content = json.dumps([model_fingerprint, list(src_ids), tgt_code, decoding], sort_keys=True, default=str)
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        keys = list(set(keys))
+        hits = dict()
+        for start in range(0, len(keys), 500):  # stays under SQLite's limit on query parameters
+            chunk = keys[start : start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.connection.execute(
+                f"SELECT key, translation FROM translations WHERE key IN ({placeholders})", chunk
+            )
+            hits.update(rows.fetchall())
+        now = time.time_ns()
+        self.connection.executemany(
+            "UPDATE translations SET last_used = ? WHERE key = ?", [(now, key) for key in hits]
+        )
+        self.connection.commit()
+        return hits
+
+    def put_many(self, translations: Dict[str, str]):
+        now = time.time_ns()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)",
+            [
+                (key, translation, len(key) + len(translation.encode("utf-8")), now)
+                for key, translation in translations.items()
+            ],
+        )
+        self.connection.commit()
+        self._evict()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+    def total_bytes(self) -> int:
+        return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM translations").fetchone()[0]
+
+    def _evict(self):
+        excess = self.total_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+        evicted = []
+        for key, size in self.connection.execute("SELECT key, size FROM translations ORDER BY last_used, key"):
+            evicted.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.connection.executemany("DELETE FROM translations WHERE key = ?", evicted)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def open_cache(path: Optional[str], max_megabytes: int = 1024) -> Optional[TranslationCache]:
+    return TranslationCache(path, max_bytes=max_megabytes << 20) if path is not None else None
@@ -1,8 +1,11 @@
-import evaluate
-import matplotlib
-matplotlib.use("Agg")
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from sacrebleu.metrics import BLEU, CHRF
+from typing import Dict, List, Optional
 
-from configure import USE_CUDA
+from corpora import apply_permutation
+from pretokenized import pad_token_ids
+from translation_cache import TranslationCache, model_fingerprint, permutation_fingerprint
 
 
 
@@ -27,11 +30,13 @@ def translate(
     )
     result = result.to('cpu')
     if permutation is not None:
-        result.apply_(permutation.get_inverse())
+        result = permutation.get_inverse().permute(result)
     return tokenizer.batch_decode(result)
 
 
 def translate_tokenized_mixture_of_bitexts(mix, model, tokenizer, lang_codes, pmap):         
+    from configure import USE_CUDA
+
     if USE_CUDA:
         model.cuda()
     batch = mix.next_batch()  
@@ -50,11 +55,205 @@ def translate_tokenized_mixture_of_bitexts(mix, model, tokenizer, lang_codes, pm
     return translations
 
 
-def evaluate_translations(candidate_translations, reference_translations):
-    bleu_calc = evaluate.load("sacrebleu")
-    chrf_calc = evaluate.load("chrf")
-    reference_translations = [[ref] for ref in reference_translations]
-    bleu_result = bleu_calc.compute(predictions = candidate_translations, references = reference_translations)
-    chrf_result = chrf_calc.compute(predictions = candidate_translations, references = reference_translations)
-    return {'bleu': round(bleu_result["score"], 3), 'chrf': round(chrf_result["score"], 3)}
+def length_sorted_batches(lengths: List[int], max_tokens: int) -> List[List[int]]:
+    """
+    Groups segment indices into batches of similar length, longest first, so that each
+    batch's padded size (number of segments times the longest segment) fits `max_tokens`.
+    """
+    order = sorted(range(len(lengths)), key=lambda k: (-lengths[k], k))
+    batches, batch = [], []
+    for k in order:
+        if len(batch) > 0 and (len(batch) + 1) * lengths[batch[0]] > max_tokens:
+            batches.append(batch)
+            batch = []
+        batch.append(k)
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+
+def translate_segments(
+    segments: List[str],
+    model,
+    tokenizer,
+    src_code: str,
+    tgt_code: str,
+    src_permutation=None,
+    tgt_permutation=None,
+    max_tokens: int = 2048,
+    cache: Optional[TranslationCache] = None,
+    fingerprint: Optional[str] = None,
+    a=32,
+    b=3,
+    num_beams=4,
+    **kwargs
+) -> List[str]:
+    """
+    Translates every segment, batching segments of similar length, and returns the translations in the original order.
+
+    If a cache is given, segments it already knows (for this model `fingerprint`, target language,
+    permutations and decoding parameters) are not translated again.
+    """
+    import torch
+
+    translations = [None] * len(segments)
+    src_ids = tokenizer.encode(segments, lang_code=src_code)
+    if cache is not None:
+        decoding = {
+            "a": a, "b": b, "num_beams": num_beams, **kwargs,
+            "src_permutation": permutation_fingerprint(src_permutation),
+            "tgt_permutation": permutation_fingerprint(tgt_permutation),
+        }
+        keys = [TranslationCache.key(fingerprint, ids, tgt_code, decoding) for ids in src_ids]
+        hits = cache.get_many(keys)
+        for k, key in enumerate(keys):
+            translations[k] = hits.get(key)
+    todo = [k for k in range(len(segments)) if translations[k] is None]
+    with torch.inference_mode():
+        for batch in length_sorted_batches([len(src_ids[k]) for k in todo], max_tokens):
+            batch = [todo[k] for k in batch]
+            src_tokenized = pad_token_ids([src_ids[k] for k in batch], tokenizer.get_special_tokens()['<pad>'])
+            if src_permutation is not None:
+                apply_permutation(src_tokenized.input_ids, src_permutation)
+            translated = translate(
+                src_tokenized, tokenizer, model, tgt_code, tgt_permutation, a=a, b=b, num_beams=num_beams, **kwargs
+            )
+            for k, translation in zip(batch, translated):
+                translations[k] = translation
+            if cache is not None:
+                cache.put_many({keys[k]: translations[k] for k in batch})
+    return translations
+
+
+def translate_bitexts(
+    bitexts,
+    model,
+    tokenizer,
+    lang_codes,
+    pmap,
+    max_tokens: int = 2048,
+    cache: Optional[TranslationCache] = None,
+    fingerprint: Optional[str] = None,
+    **kwargs
+) -> Dict[str, List[str]]:
+    """
+    Translates every source line of each bitext (e.g. the test sets of a MixtureOfBitexts).
+
+    With a cache, pass the model's `fingerprint` if it is known (e.g. `saved_model_fingerprint`);
+    otherwise every weight is hashed to compute it.
+    """
+    from configure import USE_CUDA
+
+    if USE_CUDA:
+        model.cuda()
+    if cache is not None and fingerprint is None:
+        fingerprint = model_fingerprint(model)
+    translations = dict()
+    for (src_lang, tgt_lang), bitext in bitexts.items():
+        key = '->'.join([lang_codes[src_lang], lang_codes[tgt_lang]])
+        if key not in translations:
+            translations[key] = []
+        translations[key].extend(
+            translate_segments(
+                [src for src, _ in bitext],
+                model,
+                tokenizer,
+                lang_codes[src_lang],
+                lang_codes[tgt_lang],
+                src_permutation=pmap[src_lang] if src_lang in pmap else None,
+                tgt_permutation=pmap[tgt_lang] if tgt_lang in pmap else None,
+                max_tokens=max_tokens,
+                cache=cache,
+                fingerprint=fingerprint,
+                **kwargs
+            )
+        )
+    return translations
+
+
+def collect_references(bitexts, lang_codes) -> Dict[str, List[str]]:
+    references = dict()
+    for (src_lang, tgt_lang), bitext in bitexts.items():
+        key = '->'.join([lang_codes[src_lang], lang_codes[tgt_lang]])
+        if key not in references:
+            references[key] = []
+        references[key].extend(tgt for _, tgt in bitext)
+    return references
+
+
+class TranslationScorer:
+    """
+    Scores translations with BLEU and chrF, loading the metrics once.
+
+    The per-segment sufficient statistics of each metric are extracted once, and the corpus
+    scores, sentence scores and bootstrap confidence intervals are all computed from them, so
+    hypotheses are only tokenized once. The metric settings match the defaults of the
+    "sacrebleu" and "chrf" metrics of the `evaluate` library. The statistics come from sacrebleu's
+    private API, so test_validate.py checks every score against `corpus_score` and `sentence_score`
+    (last run with sacrebleu 2.6.0).
+    """
+
+    def __init__(self, sentence_scores: bool = False, bootstrap_samples: int = 0, seed: int = 12345):
+        self.sentence_scores = sentence_scores
+        self.bootstrap_samples = bootstrap_samples
+        self.seed = seed
+        self.metrics = {"bleu": BLEU(), "chrf": CHRF()}
+        self.sentence_metrics = {"bleu": BLEU(effective_order=True), "chrf": self.metrics["chrf"]}
+
+    def score(self, candidate_translations: List[str], reference_translations: List[str]) -> dict:
+        result, sentence_results = dict(), dict()
+        for name, metric in self.metrics.items():
+            stats = np.array(metric._extract_corpus_statistics(candidate_translations, [reference_translations]))
+            result[name] = round(metric._compute_score_from_stats(stats.sum(axis=0).tolist()).score, 3)
+            if self.bootstrap_samples > 0:
+                rng = np.random.default_rng(self.seed)
+                samples = [
+                    metric._compute_score_from_stats(stats[rng.integers(0, len(stats), len(stats))].sum(axis=0).tolist()).score
+                    for _ in range(self.bootstrap_samples)
+                ]
+                result[f"{name}_ci"] = [round(float(np.percentile(samples, q)), 3) for q in (2.5, 97.5)]
+            if self.sentence_scores:
+                sentence_metric = self.sentence_metrics[name]
+                sentence_results[name] = [
+                    round(sentence_metric._compute_score_from_stats(row).score, 3) for row in stats.tolist()
+                ]
+        if self.sentence_scores:
+            result["sentences"] = sentence_results
+        return result
 
+    def score_all(
+        self, translations: Dict[str, List[str]], references: Dict[str, List[str]], num_workers: int = 1
+    ) -> Dict[str, dict]:
+        """Scores every language pair key, using `num_workers` processes."""
+        keys = list(translations)
+        if num_workers <= 1 or len(keys) <= 1:
+            return {key: self.score(translations[key], references[key]) for key in keys}
+        with ProcessPoolExecutor(
+            max_workers=min(num_workers, len(keys)),
+            initializer=_init_worker_scorer,
+            initargs=(self.sentence_scores, self.bootstrap_samples, self.seed),
+        ) as executor:
+            results = executor.map(_score_in_worker, [translations[key] for key in keys], [references[key] for key in keys])
+            return dict(zip(keys, results))
+
+
+_worker_scorer = None
+
+
+def _init_worker_scorer(sentence_scores, bootstrap_samples, seed):
+    global _worker_scorer
+    _worker_scorer = TranslationScorer(sentence_scores, bootstrap_samples, seed)
+
+
+def _score_in_worker(candidate_translations, reference_translations):
+    return _worker_scorer.score(candidate_translations, reference_translations)
+
+
+_default_scorer = None
+
+
+def evaluate_translations(candidate_translations, reference_translations):
+    global _default_scorer
+    if _default_scorer is None:
+        _default_scorer = TranslationScorer()
+    return _default_scorer.score(candidate_translations, reference_translations)